@@ -0,0 +1,209 @@
+"""
+Benchmark suite over the graphs the web editor ships(public/examples), headless EGL:
+
+  python -m benchmarks.bench_examples [graphs...] [-o results.json]
+  python -m benchmarks.bench_examples --baseline results.json --threshold 0.2
+
+Phases are measured separately: load_json, scheduling, the first frame(shader compilation,
+uploads), steady state frames, readback of the image shown by the back buffer through
+get_texture_data and through the asynchronous native path, and the number of GL calls per frame.
+With --baseline the run fails(exit code 1) when a phase is slower than the baseline by more
+than the threshold, or when a graph that used to render fails.
+Graphs that fail to render are reported with their error and don't stop the suite.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import traceback
+
+import numpy as np
+
+from renderpy.headless import create_context, destroy_context
+from renderpy.renderpy import GlobalState, BackBufferNode, gl
+
+# Metrics compared against the baseline, lower is better
+COMPARED = ["load_ms", "schedule_ms", "init_ms", "frame_ms", "readback_ms",
+            "native_readback_ms", "gl_calls"]
+
+
+class CallCounter:
+  """
+  Counts the calls made through OpenGL.GL while installed
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.saved = {}
+
+  def wrap(self, fn):
+    def counted(*args, **kwargs):
+      self.count += 1
+      return fn(*args, **kwargs)
+    return counted
+
+  def install(self):
+    for name in dir(gl):
+      fn = getattr(gl, name)
+      if name.startswith("gl") and callable(fn):
+        self.saved[name] = fn
+        setattr(gl, name, self.wrap(fn))
+
+  def uninstall(self):
+    for name, fn in self.saved.items():
+      setattr(gl, name, fn)
+    self.saved = {}
+
+
+def timed(fn):
+  start = time.perf_counter()
+  result = fn()
+  gl.glFinish()
+  return (time.perf_counter() - start) * 1000.0, result
+
+
+def best_of(fn, repeat):
+  return min(timed(fn)[0] for i in range(repeat))
+
+
+def get_display_input(global_state):
+  """
+  Returns (node, slot) of the image shown by the back buffer
+  """
+  for node in global_state.toposort():
+    if isinstance(node, BackBufferNode):
+      link = node.getInputLinkByName("in")
+      if link != None:
+        return global_state.id2node[link.origin_node_id], link.origin_slot
+  return None, None
+
+
+def bench_graph(filename, frames, width, height):
+  result = {}
+  global_state = GlobalState()
+  try:
+    result["load_ms"] = best_of(lambda: global_state.load_json(filename), 3)
+    result["schedule_ms"] = best_of(
+        lambda: (global_state.reschedule(), global_state.toposort()), 3)
+    global_state.set_offscreen(width, height)
+    result["init_ms"] = timed(global_state.render)[0]
+
+    times = [timed(global_state.render)[0] for i in range(frames)]
+    result["frame_ms"] = float(np.median(times))
+    result["frame_mean_ms"] = float(np.mean(times))
+    result["frame_p95_ms"] = float(np.percentile(times, 95))
+
+    node, slot = get_display_input(global_state)
+    if node != None and hasattr(node, 'get_target_desc'):
+      format, target_width, target_height = node.get_target_desc(slot)
+      tex = node.get_texture(slot)
+      result["readback_ms"] = best_of(lambda: global_state.get_texture_data(
+          tex, format, target_width, target_height), 3)
+      result["native_readback_ms"] = best_of(
+          lambda: global_state.read_node(node.id, slot).result(), 3)
+
+    counter = CallCounter()
+    counter.install()
+    try:
+      global_state.render()
+    finally:
+      counter.uninstall()
+    result["gl_calls"] = counter.count
+    stats = global_state.state.get_stats()
+    result["state_issued"] = stats["issued"]
+    result["state_skipped"] = stats["skipped"]
+    passes = global_state.get_pass_stats()
+    result["passes_executed"] = passes["executed"]
+    result["passes_skipped"] = passes["skipped"]
+  except Exception as e:
+    frame = traceback.extract_tb(e.__traceback__)[-1]
+    result["error"] = "%s: %s(%s:%d)" % (
+        type(e).__name__, e, os.path.basename(frame.filename), frame.lineno)
+  finally:
+    try:
+      global_state.gl_release()
+    except Exception:
+      pass
+  return result
+
+
+def compare(results, baseline, threshold, min_delta):
+  """
+  Returns the list of regressions as strings,
+  timings that moved by less than min_delta milliseconds are considered noise
+  """
+  regressions = []
+  for name, base in baseline["graphs"].items():
+    if name not in results["graphs"] or "error" in base:
+      continue
+    current = results["graphs"][name]
+    if "error" in current:
+      regressions.append("%s: fails now(%s)" % (name, current["error"]))
+      continue
+    for key in COMPARED:
+      if key not in base or key not in current or base[key] <= 0:
+        continue
+      ratio = current[key] / base[key]
+      if key.endswith("_ms") and current[key] - base[key] < min_delta:
+        continue
+      if ratio > 1.0 + threshold:
+        regressions.append("%s: %s %.2f -> %.2f(+%.0f%%)" % (
+            name, key, base[key], current[key], (ratio - 1.0) * 100.0))
+  return regressions
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Benchmarks renderpy on the example graphs")
+  parser.add_argument("graphs", nargs="*")
+  parser.add_argument("-n", "--frames", type=int, default=10, help="steady state frames")
+  parser.add_argument("--width", type=int, default=512)
+  parser.add_argument("--height", type=int, default=512)
+  parser.add_argument("-o", "--output", default=None, help="where to save the results(JSON)")
+  parser.add_argument("--baseline", default=None, help="results to compare against")
+  parser.add_argument("--threshold", type=float, default=0.2,
+                      help="allowed slowdown against the baseline, 0.2 is 20%%")
+  parser.add_argument("--min-delta", type=float, default=0.5,
+                      help="timing differences below this many ms are never regressions")
+  args = parser.parse_args(argv)
+
+  graphs = args.graphs or sorted(glob.glob("public/examples/*.json"))
+  display, context = create_context()
+  results = {
+      "renderer": gl.glGetString(gl.GL_RENDERER).decode(),
+      "frames": args.frames,
+      "resolution": [args.width, args.height],
+      "graphs": {},
+  }
+  try:
+    for filename in graphs:
+      name = os.path.basename(filename)
+      result = bench_graph(filename, args.frames, args.width, args.height)
+      results["graphs"][name] = result
+      if "error" in result:
+        print("%-24s FAILED %s" % (name, result["error"]))
+        continue
+      print("%-24s load %7.2f ms  schedule %6.3f ms  init %8.2f ms  frame %8.2f ms"
+            "(p95 %8.2f)  readback %7.2f/%7.2f ms  %5d gl calls" % (
+                name, result["load_ms"], result["schedule_ms"], result["init_ms"],
+                result["frame_ms"], result["frame_p95_ms"], result.get("readback_ms", 0.0),
+                result.get("native_readback_ms", 0.0), result["gl_calls"]))
+  finally:
+    destroy_context(display, context)
+
+  if args.output != None:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+  if args.baseline != None:
+    regressions = compare(results, json.load(open(args.baseline)), args.threshold,
+                          args.min_delta)
+    for regression in regressions:
+      print("REGRESSION " + regression)
+    if len(regressions) != 0:
+      sys.exit(1)
+    print("no regressions against %s(threshold %.0f%%)" % (args.baseline, args.threshold * 100.0))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
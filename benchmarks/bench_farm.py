@@ -0,0 +1,61 @@
+"""
+Throughput of the render farm against the number of workers(headless EGL, llvmpipe with
+one thread per worker):
+
+  python -m benchmarks.bench_farm [graph] [--jobs N] [--frames N] [--size N] [--workers 1 2 4]
+
+Pool startup(context creation, shader compilation, asset sharing) is included,
+so use enough frames for the steady state to dominate.
+"""
+import os
+import time
+import argparse
+
+from renderpy.farm import RenderFarm, FarmJob
+
+
+def measure(workers, jobs, share_assets=True):
+  farm = RenderFarm(workers, share_assets=share_assets)
+  start = time.perf_counter()
+  count = sum(1 for frame in farm.render(jobs))
+  return count, time.perf_counter() - start
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser()
+  parser.add_argument("graph", nargs="?", default="public/examples/multipass_test.json")
+  parser.add_argument("--jobs", type=int, default=None,
+                      help="copies of the graph to render, 2 per worker by default")
+  parser.add_argument("--frames", type=int, default=4, help="frames per job")
+  parser.add_argument("--size", type=int, default=256)
+  parser.add_argument("--workers", type=int, nargs="+", default=None)
+  args = parser.parse_args(argv)
+
+  cpus = os.cpu_count()
+  workers = args.workers
+  if workers == None:
+    workers = [1]
+    while workers[-1] * 2 <= cpus:
+      workers.append(workers[-1] * 2)
+    if workers[-1] != cpus:
+      workers.append(cpus)
+  jobs = [FarmJob(args.graph, args.frames, width=args.size, height=args.size)
+          for i in range(args.jobs or 2 * max(workers))]
+
+  print("%d cpus, %d jobs x %d frames of %s at %dx%d" % (
+      cpus, len(jobs), args.frames, args.graph, args.size, args.size))
+  print("%8s %10s %10s %10s %12s" % ("workers", "seconds", "fps", "speedup", "efficiency"))
+  base = None
+  for count in workers:
+    frames, seconds = measure(count, jobs)
+    fps = frames / seconds
+    base = fps if base == None else base
+    print("%8d %10.2f %10.2f %10.2f %11.0f%%" % (
+        count, seconds, fps, fps / base, fps / base / count * 100.0))
+  frames, seconds = measure(workers[-1], jobs, share_assets=False)
+  print("without shared assets at %d workers: %.2f s, %.2f fps" % (
+      workers[-1], seconds, frames / seconds))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+"""
+Graph load time and peak memory, up to the point where all the texture and vertex data
+is ready for upload. "legacy" replays the previous json.loads + replace_dict path,
+"bundle" loads the same graph converted with renderpy.bundle:
+
+  python -m benchmarks.bench_load [graph.json] [bundle.json]
+"""
+import sys
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from renderpy.renderpy import GlobalState, TextureBufferNode, VertexBufferNode, replace_dict
+
+
+def load_legacy(filename):
+  doc = replace_dict(json.load(open(filename)))
+  arrays = []
+  for node in doc.nodes:
+    src = node.properties.get("src")
+    if src == None:
+      continue
+    payload = replace_dict(json.loads(doc.config.srcs[src].code))
+    if node.type == "gfx/TextureBufferNode":
+      if payload.format == "RGBA32UI":
+        arrays.append(np.uint32(payload.data))
+      else:
+        arrays.append(np.float32(payload.data))
+    elif node.type == "gfx/VertexBufferNode":
+      for attrib in payload.attributes.values():
+        arrays.append(np.float32(attrib.data))
+      arrays.append(np.uint32(payload.indices.data))
+  return arrays
+
+
+def load_fast(filename):
+  global_state = GlobalState()
+  global_state.load_json(filename)
+  arrays = []
+  for node in global_state.nodes:
+    if isinstance(node, TextureBufferNode):
+      node.parse_src()
+      arrays.append(node.buf.data)
+    elif isinstance(node, VertexBufferNode):
+      for mesh in node.get_meshes():
+        for attrib in mesh.attributes.values():
+          arrays.append(np.ascontiguousarray(attrib.data, np.float32))
+        arrays.append(np.ascontiguousarray(mesh.indices.data, np.uint32))
+  return arrays
+
+
+def measure(fn, filename, repeat=5):
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    fn(filename)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best == None else min(best, elapsed)
+  tracemalloc.start()
+  result = fn(filename)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return best, peak, result
+
+
+def main(filename, bundle_filename=None):
+  print("%8s %10s %14s" % ("path", "time ms", "peak memory KB"))
+  results = {}
+  runs = [("legacy", load_legacy, filename), ("fast", load_fast, filename)]
+  if bundle_filename != None:
+    runs.append(("bundle", load_fast, bundle_filename))
+  for name, fn, path in runs:
+    elapsed, peak, arrays = measure(fn, path)
+    results[name] = arrays
+    print("%8s %10.2f %14.1f" % (name, elapsed * 1000.0, peak / 1024.0))
+  # Both paths must produce the same data
+  for name in results:
+    for a, b in zip(results["legacy"], results[name]):
+      assert(a.dtype == b.dtype and np.array_equal(a, b))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1] if len(sys.argv) > 1 else "public/examples/ltc.json",
+       sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,132 @@
+"""
+Python-side cost of a frame with the node traversal and with the recorded command list
+(GlobalState.replay), headless EGL:
+
+  python -m benchmarks.bench_replay [graphs...] [-n frames]
+
+Python time is the frame time minus the time spent inside the OpenGL entry points, with the
+overhead of the timing wrappers taken out. Both modes render the same frames, the final
+images are compared.
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from renderpy.headless import create_context, destroy_context
+from renderpy.renderpy import GlobalState, gl
+from renderpy import uniforms
+
+
+class GLTimer:
+  """
+  Accumulates the calls and the time spent in OpenGL.GL(and the uniform setters bound to it)
+  while installed
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.seconds = 0.0
+    self.saved = {}
+    self.saved_setters = {}
+
+  def wrap(self, fn):
+    def timed(*args, **kwargs):
+      start = time.perf_counter()
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        self.seconds += time.perf_counter() - start
+        self.count += 1
+    return timed
+
+  def install(self):
+    for name in dir(gl):
+      fn = getattr(gl, name)
+      if name.startswith("gl") and callable(fn):
+        self.saved[name] = fn
+        setattr(gl, name, self.wrap(fn))
+    self.saved_setters = dict(uniforms.UNIFORM_SETTERS)
+    for type, fn in self.saved_setters.items():
+      uniforms.UNIFORM_SETTERS[type] = self.wrap(fn)
+
+  def uninstall(self):
+    for name, fn in self.saved.items():
+      setattr(gl, name, fn)
+    uniforms.UNIFORM_SETTERS.update(self.saved_setters)
+    self.saved = {}
+
+  def get_overhead(self, count=100000):
+    """
+    Seconds a wrapper adds to a call, outside of the time it measures
+    """
+    noop = lambda: None
+    wrapped = GLTimer().wrap(noop)
+    start = time.perf_counter()
+    for i in range(count):
+      noop()
+    plain = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(count):
+      wrapped()
+    return max(0.0, (time.perf_counter() - start - plain) / count)
+
+
+def bench_mode(filename, replay, frames, warmup=3):
+  global_state = GlobalState()
+  global_state.replay = replay
+  global_state.load_json(filename)
+  global_state.set_offscreen(512, 512)
+  try:
+    for i in range(warmup):
+      global_state.render()
+    gl.glFinish()
+    timer = GLTimer()
+    overhead = timer.get_overhead()
+    timer.install()
+    try:
+      start = time.perf_counter()
+      for i in range(frames):
+        global_state.render()
+      seconds = time.perf_counter() - start
+    finally:
+      timer.uninstall()
+    image = global_state.read_texture(global_state.offscreen, "RGBA8", global_state.width,
+                                      global_state.height).result().copy()
+    python = seconds - timer.seconds - timer.count * overhead
+    return dict(frame_ms=seconds * 1000.0 / frames, gl_ms=timer.seconds * 1000.0 / frames,
+                python_us=python * 1.0e6 / frames, gl_calls=timer.count / frames), image
+  finally:
+    global_state.gl_release()
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Traversal against command list replay")
+  parser.add_argument("graphs", nargs="*", default=["public/examples/multipass_test.json"])
+  parser.add_argument("-n", "--frames", type=int, default=50)
+  args = parser.parse_args(argv)
+
+  display, context = create_context()
+  try:
+    print("%-24s %-10s %10s %10s %12s %9s" % (
+        "graph", "mode", "frame ms", "gl ms", "python us", "gl calls"))
+    for filename in args.graphs:
+      images = []
+      results = []
+      for mode, replay in [("traversal", False), ("replay", True)]:
+        result, image = bench_mode(filename, replay, args.frames)
+        images.append(image)
+        results.append(result)
+        print("%-24s %-10s %10.2f %10.2f %12.1f %9.1f" % (
+            filename.split("/")[-1], mode, result["frame_ms"], result["gl_ms"],
+            result["python_us"], result["gl_calls"]))
+      print("%-24s python side %.2fx faster, identical output: %s" % (
+          "", results[0]["python_us"] / max(results[1]["python_us"], 1e-9),
+          np.array_equal(images[0], images[1])))
+  finally:
+    destroy_context(display, context)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
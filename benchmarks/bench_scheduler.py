@@ -0,0 +1,41 @@
+"""
+Scheduling time against the graph size, no GL context needed:
+
+  python -m benchmarks.bench_scheduler [sizes...]
+"""
+import sys
+import time
+
+from renderpy.renderpy import GlobalState
+from .synthetic import make_graph
+
+SIZES = [1000, 2000, 5000, 10000, 20000, 50000]
+
+
+def measure(fn, repeat=3):
+  best = None
+  for i in range(repeat):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best == None else min(best, elapsed)
+  return best
+
+
+def main(sizes):
+  print("%8s %8s %12s %12s %12s" %
+        ("nodes", "edges", "load ms", "schedule ms", "us/node"))
+  for size in sizes:
+    graph = make_graph(size)
+    global_state = GlobalState()
+    load_time = measure(lambda: global_state.load_graph(graph), 1)
+    schedule_time = measure(global_state.reschedule)
+    print("%8d %8d %12.2f %12.2f %12.3f" % (
+        len(graph["nodes"]), len(graph["links"]), load_time * 1000.0,
+        schedule_time * 1000.0, schedule_time * 1.0e6 / size))
+    scheduled = len(global_state.toposort())
+    assert(scheduled < len(graph["nodes"]))
+
+
+if __name__ == '__main__':
+  main([int(arg) for arg in sys.argv[1:]] or SIZES)
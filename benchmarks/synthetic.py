@@ -0,0 +1,110 @@
+import random
+
+
+class GraphBuilder:
+  """
+  Builds litegraph style graph dictionaries the same way the web editor exports them
+  """
+
+  def __init__(self):
+    self.nodes = []
+    self.links = []
+    self.srcs = {}
+    self.last_node_id = 0
+    self.last_link_id = 0
+
+  def add_node(self, type, title, inputs=(), properties=None, outputs=1):
+    self.last_node_id += 1
+    node = {
+        "id": self.last_node_id,
+        "type": type,
+        "title": title,
+        "inputs": [{"name": name, "type": slot_type, "link": None} for name, slot_type in inputs],
+        "outputs": [{"name": "out%d" % i, "type": "", "links": []} for i in range(outputs)],
+        "properties": properties or {},
+    }
+    self.nodes.append(node)
+    return node
+
+  def connect(self, origin, origin_slot, target, target_slot):
+    self.last_link_id += 1
+    type = target["inputs"][target_slot]["type"]
+    self.links.append([self.last_link_id, origin["id"], origin_slot,
+                       target["id"], target_slot, type])
+    target["inputs"][target_slot]["link"] = self.last_link_id
+    origin["outputs"][origin_slot]["links"].append(self.last_link_id)
+
+  def add_pipeline(self, vs, ps, attributes, uniforms):
+    return self.add_node("gfx/PipelineNode", "Pipeline", properties={
+        "vs": vs, "ps": ps, "attributes": attributes, "uniforms": uniforms})
+
+  def add_vertex_buffer(self, src):
+    return self.add_node("gfx/VertexBufferNode", "Vertex Buffer", properties={"src": src})
+
+  def add_draw_call(self, pipeline, mesh, uniforms):
+    inputs = [("pipeline", "pipeline_t"), ("mesh", "mesh_t")]
+    inputs += [(name, "uniform_t") for name in uniforms]
+    node = self.add_node("gfx/DrawCallNode", "Draw Call", inputs)
+    self.connect(pipeline, 0, node, 0)
+    self.connect(mesh, 0, node, 1)
+    return node
+
+  def add_pass(self, draw_calls, width=64, height=64, rts=("RGBA32F",), depth=None):
+    inputs = [("DC#%d" % i, "drawcall_t") for i in range(len(draw_calls))]
+    node = self.add_node("gfx/PassNode", "Pass", inputs, properties={
+        "viewport": {"width": width, "height": height},
+        "rts": [{"format": format} for format in rts],
+        "depth": {"format": depth} if depth else None,
+    }, outputs=len(rts) + 1)
+    for i, dc in enumerate(draw_calls):
+      self.connect(dc, 0, node, i)
+    return node
+
+  def add_back_buffer(self, input):
+    node = self.add_node("gfx/BackBufferNode", "Back Buffer", [("in", "uniform_t")])
+    self.connect(input, 0, node, 0)
+    return node
+
+  def build(self):
+    return {
+        "last_node_id": self.last_node_id,
+        "last_link_id": self.last_link_id,
+        "nodes": self.nodes,
+        "links": self.links,
+        "groups": [],
+        "config": {"srcs": dict((name, {"code": code}) for name, code in self.srcs.items())},
+        "version": 0.4,
+    }
+
+
+def make_graph(num_nodes, fan_in=3, islands=0.1, seed=0):
+  """
+  Returns a synthetic graph of about num_nodes nodes: a chain of passes where every draw call
+  samples the previous pass and up to fan_in-1 random earlier ones, plus a fraction of
+  disconnected islands that the scheduler is expected to prune
+  """
+  rng = random.Random(seed)
+  builder = GraphBuilder()
+  uniforms = ["iChannel%d" % i for i in range(fan_in)]
+  pipeline = builder.add_pipeline("ss.vs.glsl", "ss.ps.glsl",
+                                  [{"name": "position", "type": "vec3"}],
+                                  [{"name": name, "type": "texture"} for name in uniforms])
+  mesh = builder.add_vertex_buffer("triangle_pos")
+  island_nodes = int(num_nodes * islands)
+  passes = []
+  # Every step adds a draw call and a pass
+  while len(builder.nodes) < num_nodes - island_nodes - 1:
+    dc = builder.add_draw_call(pipeline, mesh, uniforms)
+    if len(passes) != 0:
+      builder.connect(passes[-1], 0, dc, 2)
+      for slot in range(3, 2 + fan_in):
+        builder.connect(rng.choice(passes), 0, dc, slot)
+    passes.append(builder.add_pass([dc]))
+  builder.add_back_buffer(passes[-1])
+  island_passes = []
+  while len(builder.nodes) < num_nodes:
+    dc = builder.add_draw_call(pipeline, mesh, uniforms)
+    if len(island_passes) != 0:
+      builder.connect(rng.choice(island_passes), 0, dc, 2)
+    island_passes.append(builder.add_pass([dc]))
+  return builder.build()
@@ -0,0 +1,204 @@
+"""
+Model assets: glTF(or anything trimesh reads) converted into the arrays the renderer uploads.
+
+With a cache directory the converted meshes are stored as <hash>.json + <hash>.bin, in the
+bundle layout, keyed by the hash of the model file and the buffers it references. Later loads
+memory-map the .bin and don't import trimesh at all.
+
+  python -m renderpy.assets public/models/LeePerrySmith/LeePerrySmith.gltf -o .cache/models
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from .bundle import Bundle, BundleWriter
+from .mesh_opt import optimize_mesh
+
+ASSET_VERSION = 1
+MATERIAL_FACTORS = ["baseColorFactor", "metallicFactor", "roughnessFactor", "emissiveFactor"]
+
+
+def get_dependencies(filename):
+  """
+  Returns the files a model is made of, the external buffers and images of a .gltf included
+  """
+  files = [filename]
+  if filename.lower().endswith(".gltf"):
+    root = os.path.dirname(filename)
+    doc = json.load(open(filename))
+    for item in doc.get("buffers", []) + doc.get("images", []):
+      uri = item.get("uri")
+      if uri != None and not uri.startswith("data:"):
+        files.append(os.path.join(root, uri))
+  return files
+
+
+def hash_model(filename):
+  h = hashlib.sha1()
+  h.update(b"%d" % ASSET_VERSION)
+  for dependency in get_dependencies(filename):
+    h.update(b"\0")
+    with open(dependency, "rb") as f:
+      for block in iter(lambda: f.read(1 << 20), b""):
+        h.update(block)
+  return h.hexdigest()
+
+
+def get_material(geom):
+  material = getattr(geom.visual, "material", None)
+  if material == None:
+    return {}
+  refs = {"name": getattr(material, "name", None)}
+  for factor in MATERIAL_FACTORS:
+    value = getattr(material, factor, None)
+    if value is not None:
+      refs[factor] = np.asarray(value).tolist()
+  return refs
+
+
+def import_model(filename):
+  """
+  Returns [{"attributes": {name: {"data", "type"}}, "indices": {"data", "type"}, "material"}],
+  one entry per geometry of the scene
+  """
+  import trimesh
+  scene = trimesh.load(filename, force="scene")
+  meshes = []
+  for name, geom in scene.geometry.items():
+    attributes = {
+        "position": {"data": np.asarray(geom.vertices, np.float32).flatten(), "type": "vec3"},
+        "normal": {"data": np.asarray(geom.vertex_normals, np.float32).flatten(), "type": "vec3"},
+    }
+    uv = getattr(geom.visual, "uv", None)
+    if uv is not None:
+      attributes["uv"] = {"data": np.asarray(uv, np.float32).flatten(), "type": "vec2"}
+    meshes.append({
+        "name": name,
+        "attributes": attributes,
+        "indices": {"data": np.asarray(geom.faces, np.uint32).flatten(), "type": "uint32"},
+        "material": get_material(geom),
+    })
+  return meshes
+
+
+def write_json(filename, d):
+  with open(filename, "w") as f:
+    json.dump(d, f)
+
+
+class ModelCache:
+  """
+  Converted models by content hash, in memory and in `path` when it is set.
+  Hashes are remembered per (file, size, mtime) so unchanged files are hashed once per process.
+  With optimize the meshes go through renderpy.mesh_opt before they are cached,
+  the stats of the optimization are kept in mesh["stats"]
+  """
+
+  def __init__(self, path=None, optimize=False):
+    self.path = path
+    self.optimize = optimize
+    self.hashes = {}
+    self.models = {}
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+  def get_hash(self, filename):
+    stats = [os.stat(dependency) for dependency in get_dependencies(filename)]
+    stamp = tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+    entry = self.hashes.get(filename)
+    if entry == None or entry[0] != stamp:
+      entry = (stamp, hash_model(filename))
+      self.hashes[filename] = entry
+    return entry[1]
+
+  def get_key(self, filename):
+    return self.get_hash(filename) + ("-opt" if self.optimize else "")
+
+  def load(self, filename):
+    """
+    Returns the meshes of the model(see import_model), arrays are read only
+    """
+    key = self.get_key(filename)
+    meshes = self.models.get(key)
+    if meshes != None:
+      self.hits += 1
+      return meshes
+    meshes = self.load_cached(key)
+    if meshes != None:
+      self.disk_hits += 1
+    else:
+      self.misses += 1
+      meshes = import_model(filename)
+      if self.optimize:
+        for mesh in meshes:
+          mesh["attributes"], mesh["indices"], mesh["stats"] = optimize_mesh(
+              mesh["attributes"], mesh["indices"])
+      self.store(key, meshes)
+    self.models[key] = meshes
+    return meshes
+
+  def get_cache_path(self, key, ext):
+    return os.path.join(self.path, key + ext)
+
+  def load_cached(self, key):
+    if self.path == None:
+      return None
+    skeleton_filename = self.get_cache_path(key, ".json")
+    if not os.path.exists(skeleton_filename):
+      return None
+    try:
+      skeleton = json.load(open(skeleton_filename))
+      if skeleton.get("version") != ASSET_VERSION:
+        return None
+      return Bundle(self.get_cache_path(key, ".bin")).decode(skeleton["meshes"])
+    except (OSError, ValueError, KeyError):
+      # Partial or foreign file, convert the model again
+      return None
+
+  def store(self, key, meshes):
+    if self.path == None:
+      return
+    writer = BundleWriter()
+    skeleton = {"version": ASSET_VERSION, "meshes": writer.encode(meshes)}
+    os.makedirs(self.path, exist_ok=True)
+    # The sidecar goes first and both files are renamed into place, so concurrent processes
+    # never see a skeleton without its data
+    for ext, write in [(".bin", writer.write), (".json", lambda f: write_json(f, skeleton))]:
+      filename = self.get_cache_path(key, ext)
+      tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+      write(tmp_filename)
+      os.replace(tmp_filename, filename)
+
+  def get_stats(self):
+    return dict(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+                models=len(self.models))
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Converts models into the model cache")
+  parser.add_argument("models", nargs="+")
+  parser.add_argument("-o", "--output", default=".cache/models")
+  parser.add_argument("--optimize", action="store_true",
+                      help="merge vertices, reorder for the vertex cache, 16 bit indices")
+  args = parser.parse_args(argv)
+  cache = ModelCache(args.output, args.optimize)
+  for filename in args.models:
+    meshes = cache.load(filename)
+    print("%s -> %s(%d meshes, %d vertices)" % (
+        filename, cache.get_cache_path(cache.get_key(filename), ".bin"), len(meshes),
+        sum(len(mesh["attributes"]["position"]["data"]) // 3 for mesh in meshes)))
+    for mesh in meshes:
+      if "stats" in mesh:
+        stats = mesh["stats"]
+        print("  %s: %d -> %d vertices, ACMR %.3f -> %.3f, %s indices" % (
+            mesh["name"], stats["vertices_before"], stats["vertices_after"],
+            stats["acmr_before"], stats["acmr_after"], mesh["indices"]["type"]))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
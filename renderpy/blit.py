@@ -0,0 +1,163 @@
+import OpenGL.GL as gl
+
+from .state import create_texture, create_framebuffer
+
+BLIT_VS = """#version 300 es
+      precision highp float;
+      out vec2 uv;
+      void main() {
+          // Fullscreen triangle (-1, -1), (3, -1), (-1, 3), no vertex buffer needed
+          vec2 position = vec2(float((gl_VertexID & 1) << 2) - 1.0,
+                               float((gl_VertexID & 2) << 1) - 1.0);
+          uv = 0.5 * (position + 1.0);
+          uv.y = 1.0 - uv.y;
+          gl_Position = vec4(position, 0, 1);
+      }
+      """
+
+BLIT_PS = """#version 300 es
+      precision highp float;
+      precision highp int;
+      precision highp usampler2D;
+      precision highp isampler2D;
+      in vec2 uv;
+      uniform sampler2D in_tex;
+      out vec4 fragColor;
+      void main() {
+          fragColor = vec4(vec3(texture(in_tex, uv).xyz), 1.0);
+      }
+      """
+
+BLIT_FORMATS = ["RGBA32F", "RGBA32UI", "RGBA8UN"]
+
+
+class Blitter:
+  """
+  Persistent resources for moving pixels around: program variants per (format, flipy),
+  an empty VAO for the gl_VertexID triangle and a couple of scratch framebuffers.
+  All of it is created once and reused for every call.
+  flipy has the same meaning everywhere: False mirrors the image vertically.
+  """
+
+  def __init__(self, program_cache, state):
+    self.program_cache = program_cache
+    self.state = state
+    self.programs = {}
+    self.vao = None
+    self.read_fb = None
+    self.draw_fb = None
+    self.target = None
+
+  def get_program(self, format, flipy):
+    key = (format, flipy)
+    program = self.programs.get(key)
+    if program != None:
+      return program
+    if format not in BLIT_FORMATS:
+      raise RuntimeError("unknown format %s" % format)
+    vs = BLIT_VS
+    ps = BLIT_PS
+    if flipy:
+      vs = vs.replace("uv.y = 1.0 - uv.y;", "uv.y = uv.y;")
+    if format == "RGBA32UI":
+      ps = ps.replace("uniform sampler2D", "uniform usampler2D")
+    program = self.program_cache.acquire(vs, ps)
+    gl.glProgramUniform1i(program, gl.glGetUniformLocation(program, "in_tex"), 0)
+    self.programs[key] = program
+    return program
+
+  def get_vao(self):
+    if self.vao == None:
+      self.vao = gl.glGenVertexArrays(1)
+    return self.vao
+
+  def get_framebuffers(self):
+    if self.read_fb == None:
+      self.read_fb = create_framebuffer()
+      self.draw_fb = create_framebuffer()
+    return self.read_fb, self.draw_fb
+
+  def draw(self, tex, format=None, flipy=False):
+    """
+    Renders a fullscreen triangle with the given texture into the bound framebuffer
+    """
+    state = self.state
+    state.use_program(self.get_program(format or "RGBA32F", flipy))
+    state.bind_vertex_array(self.get_vao())
+    state.bind_texture(0, tex)
+    state.bind_sampler(0, state.get_sampler())
+
+    state.disable(gl.GL_CULL_FACE)
+    state.front_face(gl.GL_CW)
+    state.disable(gl.GL_DEPTH_TEST)
+    state.disable(gl.GL_SCISSOR_TEST)
+    state.depth_func(gl.GL_LEQUAL)
+    state.disable(gl.GL_BLEND)
+    state.blend_func(gl.GL_ONE, gl.GL_ONE)
+    gl.glDrawArrays(gl.GL_TRIANGLES, 0, 3)
+
+  def copy(self, src, dst, width, height, flipy=False, depth=False):
+    """
+    Copies src into dst of the same format without running a shader.
+    Unflipped copies go through glCopyImageSubData, flipped ones through glBlitFramebuffer
+    """
+    if flipy:
+      gl.glCopyImageSubData(src, gl.GL_TEXTURE_2D, 0, 0, 0, 0,
+                            dst, gl.GL_TEXTURE_2D, 0, 0, 0, 0,
+                            width, height, 1)
+      return
+    attachment = gl.GL_DEPTH_ATTACHMENT if depth else gl.GL_COLOR_ATTACHMENT0
+    mask = gl.GL_DEPTH_BUFFER_BIT if depth else gl.GL_COLOR_BUFFER_BIT
+    read_fb, draw_fb = self.get_framebuffers()
+    gl.glNamedFramebufferTexture(read_fb, attachment, src, 0)
+    gl.glNamedFramebufferTexture(draw_fb, attachment, dst, 0)
+    self.state.disable(gl.GL_SCISSOR_TEST)
+    gl.glBlitNamedFramebuffer(read_fb, draw_fb,
+                              0, 0, width, height,
+                              0, height, width, 0,
+                              mask, gl.GL_NEAREST)
+    gl.glNamedFramebufferTexture(read_fb, attachment, 0, 0)
+    gl.glNamedFramebufferTexture(draw_fb, attachment, 0, 0)
+
+  def bind_target(self, width, height):
+    """
+    Binds a persistent RGBA8 render target of the given size, used for readbacks
+    """
+    if self.target != None and (self.target.width, self.target.height) != (width, height):
+      self.release_target()
+    if self.target == None:
+      tex = create_texture()
+      gl.glTextureStorage2D(tex, 1, gl.GL_RGBA8, width, height)
+      fb = create_framebuffer()
+      gl.glNamedFramebufferTexture(fb, gl.GL_COLOR_ATTACHMENT0, tex, 0)
+      self.target = BlitTarget(tex, fb, width, height)
+    self.state.bind_framebuffer(self.target.fb)
+    return self.target
+
+  def release_target(self):
+    self.state.delete_framebuffer(self.target.fb)
+    self.state.delete_texture(self.target.tex)
+    self.target = None
+
+  def gl_release(self):
+    for program in self.programs.values():
+      self.program_cache.release(program)
+    self.programs = {}
+    if self.vao != None:
+      self.state.delete_vertex_array(self.vao)
+      self.vao = None
+    if self.read_fb != None:
+      self.state.delete_framebuffer(self.read_fb)
+      self.state.delete_framebuffer(self.draw_fb)
+      self.read_fb = None
+      self.draw_fb = None
+    if self.target != None:
+      self.release_target()
+
+
+class BlitTarget:
+  def __init__(self, tex, fb, width, height):
+    self.tex = tex
+    self.fb = fb
+    self.width = width
+    self.height = height
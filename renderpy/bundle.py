@@ -0,0 +1,156 @@
+"""
+Binary graph bundles: the graph JSON plus a sidecar file with the raw arrays.
+
+A payload source in config.srcs like {"code": "{\"data\": [...], ...}"} becomes
+{"code": null, "binary": {"data": {"$array": {"dtype": "<f4", "shape": [N], "offset": O}}, ...}}
+and config.bundle = {"file": "<name>.bin", "version": 1} points at the sidecar.
+Arrays are little-endian, aligned to ALIGNMENT bytes and memory-mapped on load.
+
+  python -m renderpy.bundle public/examples/*.json -o bundles/
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from .loader import parse_payload
+
+BUNDLE_VERSION = 1
+ALIGNMENT = 64
+ARRAY_KEY = "$array"
+
+
+class BundleWriter:
+  def __init__(self):
+    self.chunks = []
+    self.size = 0
+
+  def add(self, arr):
+    arr = np.ascontiguousarray(arr)
+    arr = arr.astype(arr.dtype.newbyteorder("<"), copy=False)
+    offset = (self.size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    if offset != self.size:
+      self.chunks.append(bytes(offset - self.size))
+    self.chunks.append(arr.tobytes())
+    self.size = offset + arr.nbytes
+    return {ARRAY_KEY: {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}}
+
+  def encode(self, d):
+    """
+    Returns a copy of the payload with the arrays replaced by descriptors
+    """
+    if isinstance(d, np.ndarray):
+      return self.add(d)
+    if isinstance(d, dict):
+      return dict((key, self.encode(value)) for key, value in d.items())
+    if isinstance(d, list):
+      return [self.encode(item) for item in d]
+    return d
+
+  def write(self, filename):
+    with open(filename, "wb") as f:
+      for chunk in self.chunks:
+        f.write(chunk)
+
+
+class Bundle:
+  """
+  Memory-mapped sidecar, arrays are views into the mapping so nothing is copied until upload
+  """
+
+  def __init__(self, filename, data=None):
+    """
+    data is an optional uint8 buffer to read the arrays from instead of mapping the file
+    """
+    self.filename = filename
+    # Identifies the content of the sidecar, see GlobalState.reload_graph
+    self.stamp = None
+    if data is not None:
+      self.data = data
+    else:
+      stat = os.stat(filename)
+      self.stamp = (stat.st_size, stat.st_mtime_ns)
+      if stat.st_size == 0:
+        self.data = np.zeros(0, np.uint8)
+      else:
+        self.data = np.memmap(filename, np.uint8, mode="r")
+
+  def get_array(self, desc):
+    dtype = np.dtype(desc["dtype"])
+    count = int(np.prod(desc["shape"], dtype=np.int64))
+    arr = np.frombuffer(self.data, dtype, count, desc["offset"])
+    return arr.reshape(desc["shape"])
+
+  def decode(self, d):
+    """
+    Returns a copy of the payload skeleton with the descriptors replaced by the arrays
+    """
+    if isinstance(d, dict):
+      if ARRAY_KEY in d:
+        return self.get_array(d[ARRAY_KEY])
+      return dict((key, self.decode(value)) for key, value in d.items())
+    if isinstance(d, list):
+      return [self.decode(item) for item in d]
+    return d
+
+
+def try_parse_payload(text):
+  if not isinstance(text, str):
+    return None
+  try:
+    payload = parse_payload(text)
+  except ValueError:
+    return None
+  return payload if isinstance(payload, dict) else None
+
+
+def has_arrays(d):
+  if isinstance(d, np.ndarray):
+    return True
+  if isinstance(d, dict):
+    return any(has_arrays(value) for value in d.values())
+  if isinstance(d, list):
+    return any(has_arrays(item) for item in d)
+  return False
+
+
+def convert(src_filename, dst_filename):
+  """
+  Converts a graph exported by the editor into a bundle: dst_filename and its .bin sidecar
+  """
+  doc = json.load(open(src_filename))
+  writer = BundleWriter()
+  srcs = doc.get("config", {}).get("srcs", {})
+  for name, src in srcs.items():
+    payload = try_parse_payload(src.get("code"))
+    if payload == None or not has_arrays(payload):
+      continue
+    src["code"] = None
+    src["binary"] = writer.encode(payload)
+  bin_filename = os.path.splitext(dst_filename)[0] + ".bin"
+  doc.setdefault("config", {})["bundle"] = {
+      "file": os.path.basename(bin_filename), "version": BUNDLE_VERSION}
+  writer.write(bin_filename)
+  with open(dst_filename, "w") as f:
+    json.dump(doc, f)
+  return dst_filename, bin_filename
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Converts graphs into binary bundles")
+  parser.add_argument("graphs", nargs="+")
+  parser.add_argument("-o", "--output", default="bundles")
+  args = parser.parse_args(argv)
+  os.makedirs(args.output, exist_ok=True)
+  for filename in args.graphs:
+    dst_filename = os.path.join(args.output, os.path.basename(filename))
+    dst_filename, bin_filename = convert(filename, dst_filename)
+    print("%s -> %s(%d bytes) + %s(%d bytes)" % (
+        filename, dst_filename, os.path.getsize(dst_filename),
+        bin_filename, os.path.getsize(bin_filename)))
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,113 @@
+"""
+Record once / replay: GlobalState.compile turns the scheduled graph into a flat list of steps
+with the framebuffers, programs, uniform locations, texture units and vertex arrays resolved
+up front. Replaying it every frame skips the node traversal, the input lookups and the
+retained mode signature checks; only the dynamic values(value node outputs such as the frame
+count, feedback history textures) are read through small (getter, slot) pairs.
+
+A command list is valid for one graph version(see GlobalState.graph_version), anything that
+changes the graph through GlobalState recompiles it on the next frame.
+"""
+import OpenGL.GL as gl
+
+from .uniforms import DRAW_BINDING, set_uniform
+
+
+class DrawCommand:
+  """
+  One draw call of a pass. textures are (unit, texture, getter, slot, sampler), the getter is
+  None for textures that don't change between frames. values are (location, type, getter,
+  slot) of the default block, block_values (name, getter, slot) of the Draw block.
+  version and origins(the nodes the textures come from) feed the pass signature
+  """
+
+  def __init__(self, bind, array, version):
+    self.bind = bind
+    self.array = array
+    self.version = version
+    self.origins = []
+    self.resolution = None
+    self.textures = []
+    self.values = []
+    self.block = None
+    self.block_values = []
+
+  def run(self, state):
+    self.bind()
+    if self.resolution != None:
+      gl.glUniform2f(*self.resolution)
+    for unit, tex, get, slot, sampler in self.textures:
+      state.bind_texture(unit, tex if get == None else get(slot))
+      if sampler != None:
+        state.bind_sampler(unit, sampler)
+    for loc, type, get, slot in self.values:
+      set_uniform(loc, type, get(slot))
+    block = self.block
+    if block != None:
+      for name, get, slot in self.block_values:
+        block.set(name, get(slot))
+      block.upload()
+      state.bind_buffer_base(gl.GL_UNIFORM_BUFFER, DRAW_BINDING, block.buffer)
+    self.array.draw(state)
+
+
+class PassCommand:
+  """
+  A pass and its draws. A cacheable pass(see GlobalState.get_cacheable) is skipped when the
+  values it reads and the render counts of the nodes it samples are the same as last time
+  """
+
+  def __init__(self, node, draws, cacheable):
+    self.node = node
+    self.draws = draws
+    self.cacheable = cacheable
+    self.label = node.get_label()
+    self.versions = (node.gl_version, tuple(draw.version for draw in draws))
+    self.values = [(get, slot) for draw in draws for loc, type, get, slot in draw.values]
+    self.values += [(get, slot) for draw in draws for name, get, slot in draw.block_values]
+    self.origins = [origin for draw in draws for origin in draw.origins]
+
+  def run(self, global_state):
+    node = self.node
+    if self.cacheable:
+      signature = (self.versions, tuple(get(slot) for get, slot in self.values),
+                   tuple(origin.render_count for origin in self.origins))
+      if signature == node.gl_result:
+        global_state.passes_skipped += 1
+        return
+      node.gl_result = signature
+    global_state.passes_executed += 1
+    state = global_state.state
+    gl.glPushDebugGroup(gl.GL_DEBUG_SOURCE_APPLICATION, 0, -1, self.label)
+    node.bind()
+    for draw in self.draws:
+      draw.run(state)
+    gl.glPopDebugGroup()
+    node.render_count += 1
+
+
+class NodeCommand:
+  """
+  Nodes without a compiled form(back buffer, feedback copies) run their gl_render
+  """
+
+  def __init__(self, node):
+    self.node = node
+
+  def run(self, global_state):
+    self.node.gl_render()
+    self.node.render_count += 1
+
+
+class CommandList:
+  def __init__(self, version, order, steps):
+    self.version = version
+    self.order = order
+    self.steps = steps
+
+  def is_valid(self, version, order):
+    return version == self.version and order is self.order
+
+  def replay(self, global_state):
+    for step in self.steps:
+      step.run(global_state)
@@ -0,0 +1,249 @@
+"""
+Renders batches of graphs and frame ranges on a pool of processes, one headless GL context
+per worker. Results come back in job and frame order.
+
+Decoded assets(config.srcs payloads, ModelNode meshes) are decoded once by the parent and
+packed into a shared memory block in the bundle layout, the workers map the arrays in place.
+
+Graphs with scheduled FeedbackNodes depend on all the previous frames, their frame ranges
+are rendered by a single worker unless split_stateful is set(every chunk then starts from
+an empty history).
+
+  python -m renderpy.farm public/examples/*.json -n 32 -j 4 -o out/
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import matplotlib.image
+
+from .headless import create_context, render_frames
+from .renderpy import GlobalState, ModelNode, Mesh, replace_dict
+from .bundle import Bundle, BundleWriter
+
+
+class FarmJob:
+  def __init__(self, graph, count=1, first=0, width=512, height=512):
+    self.graph = graph
+    self.count = count
+    self.first = first
+    self.width = width
+    self.height = height
+
+
+class Chunk:
+  def __init__(self, job_id, job, first, count, stateful):
+    self.job_id = job_id
+    self.stateful = stateful
+    self.graph = job.graph
+    self.first = first
+    self.count = count
+    self.width = job.width
+    self.height = job.height
+
+
+def decode_assets(graphs, model_cache=None):
+  """
+  Returns {graph: {"payloads": {src name: payload}, "models": {node id: [mesh dict]}}}
+  with the assets of every graph decoded, no GL needed
+  """
+  assets = {}
+  for graph in graphs:
+    global_state = GlobalState(model_cache_dir=model_cache)
+    global_state.load_json(graph)
+    payloads = {}
+    models = {}
+    for node in global_state.nodes:
+      if isinstance(node, ModelNode):
+        models[str(node.id)] = [dict(attributes=mesh.attributes, indices=mesh.indices,
+                                     material=mesh.material)
+                                for mesh in node.get_meshes()]
+      elif "src" in node.properties and node.properties.src != None:
+        name = node.properties.src
+        if name in global_state.json.config.srcs:
+          payload = global_state.get_payload(name)
+          if payload != None:
+            payloads[name] = payload
+    assets[graph] = dict(payloads=payloads, models=models)
+  return assets
+
+
+def pack_assets(assets):
+  """
+  Packs the arrays into a new shared memory block, returns (block, skeleton)
+  """
+  writer = BundleWriter()
+  skeleton = writer.encode(assets)
+  block = shared_memory.SharedMemory(create=True, size=max(writer.size, 1))
+  offset = 0
+  for chunk in writer.chunks:
+    block.buf[offset:offset + len(chunk)] = chunk
+    offset += len(chunk)
+  return block, skeleton
+
+
+# Per process state of the workers
+worker = None
+
+
+class Worker:
+  def __init__(self, shared_name, skeleton, program_cache, model_cache):
+    self.display, self.context = create_context()
+    self.assets = None
+    if shared_name != None:
+      # Arrays decoded from the block are views into the shared memory
+      self.block = shared_memory.SharedMemory(name=shared_name)
+      self.assets = Bundle(shared_name, np.frombuffer(self.block.buf, np.uint8))
+    self.skeleton = skeleton
+    # With shared assets there is nothing left to decode in the background
+    self.global_state = GlobalState(program_cache, model_cache,
+                                    asset_threads=0 if shared_name != None else None)
+    self.graph = None
+
+  def load(self, chunk):
+    """
+    (Re)loads the graph, the program cache of the worker is kept across graphs
+    """
+    global_state = self.global_state
+    global_state.load_json(chunk.graph)
+    if self.assets != None and chunk.graph in self.skeleton:
+      assets = self.assets.decode(self.skeleton[chunk.graph])
+      for name, payload in assets["payloads"].items():
+        global_state.set_payload(name, replace_dict(payload))
+      for node_id, meshes in assets["models"].items():
+        node = global_state.id2node[int(node_id)]
+        node.meshes = []
+        for mesh_dict in meshes:
+          mesh = Mesh()
+          mesh.init_asset(mesh_dict)
+          node.meshes.append(mesh)
+    self.graph = chunk.graph
+
+  def render(self, chunk):
+    global_state = self.global_state
+    # A stateful graph is only continued from the frame it stopped at
+    if self.graph != chunk.graph or (chunk.stateful and global_state.frame_count != chunk.first):
+      self.load(chunk)
+    if global_state.offscreen == None or (
+        (global_state.width, global_state.height) != (chunk.width, chunk.height)):
+      global_state.set_offscreen(chunk.width, chunk.height)
+    global_state.frame_count = chunk.first
+    start = time.perf_counter()
+    images = [image.copy() for frame, image, seconds in
+              render_frames(global_state, chunk.count)]
+    return chunk.job_id, chunk.first, images, time.perf_counter() - start
+
+
+def init_worker(shared_name, skeleton, program_cache, model_cache, threads):
+  global worker
+  if threads != None:
+    os.environ["LP_NUM_THREADS"] = str(threads)
+  worker = Worker(shared_name, skeleton, program_cache, model_cache)
+
+
+def render_chunk(chunk):
+  return worker.render(chunk)
+
+
+def is_stateful(graph):
+  global_state = GlobalState()
+  global_state.load_json(graph)
+  return any(node.is_recursive for node in global_state.toposort())
+
+
+class RenderFarm:
+  """
+  Process pool of headless renderers.
+  threads is the number of llvmpipe threads per worker(LP_NUM_THREADS), 1 by default so that
+  the workers don't fight over the cores; None leaves the driver default
+  """
+
+  def __init__(self, workers=None, chunk_size=8, split_stateful=False, program_cache=None,
+               share_assets=True, threads=1, start_method="spawn", model_cache=None):
+    self.workers = workers or os.cpu_count()
+    self.chunk_size = chunk_size
+    self.split_stateful = split_stateful
+    self.program_cache = program_cache
+    self.model_cache = model_cache
+    self.share_assets = share_assets
+    self.threads = threads
+    self.start_method = start_method
+
+  def split(self, jobs):
+    chunks = []
+    stateful = {}
+    for job_id, job in enumerate(jobs):
+      if job.graph not in stateful:
+        stateful[job.graph] = is_stateful(job.graph)
+      size = self.chunk_size
+      if stateful[job.graph] and not self.split_stateful:
+        size = max(job.count, 1)
+      for first in range(job.first, job.first + job.count, size):
+        chunks.append(Chunk(job_id, job, first, min(size, job.first + job.count - first),
+                            stateful[job.graph]))
+    return chunks
+
+  def render(self, jobs):
+    """
+    Yields (job index, frame, image) for every frame of every job, in order.
+    Images are (height, width, 4) uint8 with the rows top to bottom
+    """
+    chunks = self.split(jobs)
+    block = None
+    skeleton = None
+    if self.share_assets:
+      graphs = sorted(set(job.graph for job in jobs))
+      block, skeleton = pack_assets(decode_assets(graphs, self.model_cache))
+    context = multiprocessing.get_context(self.start_method)
+    try:
+      with context.Pool(self.workers, init_worker,
+                        (block.name if block != None else None, skeleton,
+                         self.program_cache, self.model_cache, self.threads)) as pool:
+        for job_id, first, images, seconds in pool.imap(render_chunk, chunks):
+          for i, image in enumerate(images):
+            yield job_id, first + i, image
+    finally:
+      if block != None:
+        block.close()
+        block.unlink()
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Renders graphs on a pool of processes")
+  parser.add_argument("graphs", nargs="+")
+  parser.add_argument("-n", "--frames", type=int, default=1)
+  parser.add_argument("-j", "--workers", type=int, default=None)
+  parser.add_argument("--width", type=int, default=512)
+  parser.add_argument("--height", type=int, default=512)
+  parser.add_argument("--chunk-size", type=int, default=8)
+  parser.add_argument("--split-stateful", action="store_true",
+                      help="split graphs with feedback too, every chunk starts with an empty history")
+  parser.add_argument("--program-cache", default=None)
+  parser.add_argument("--model-cache", default=None)
+  parser.add_argument("-o", "--output", default=None, help="directory for the .png frames")
+  args = parser.parse_args(argv)
+
+  jobs = [FarmJob(graph, args.frames, width=args.width, height=args.height)
+          for graph in args.graphs]
+  farm = RenderFarm(args.workers, args.chunk_size, args.split_stateful, args.program_cache,
+                    model_cache=args.model_cache)
+  start = time.perf_counter()
+  count = 0
+  for job_id, frame, image in farm.render(jobs):
+    if args.output != None:
+      name = os.path.splitext(os.path.basename(jobs[job_id].graph))[0]
+      os.makedirs(args.output, exist_ok=True)
+      matplotlib.image.imsave(os.path.join(args.output, "%s_%04d.png" % (name, frame)), image)
+    count += 1
+  seconds = time.perf_counter() - start
+  print("%d frames in %.2f s, %.2f fps with %d workers" % (
+      count, seconds, count / seconds, farm.workers), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
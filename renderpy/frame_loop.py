@@ -0,0 +1,198 @@
+"""
+Render loop driver: keeps up to frames_in_flight frames queued on the GPU with one fence per
+frame, optionally paced to a target frame rate, and records the timing of every frame.
+
+  loop = FrameLoop(global_state, frames_in_flight=2, target_fps=60)
+  while running:
+    loop.step(present=glut.glutSwapBuffers)
+  print(loop.format_stats())
+
+Per frame: the frame time(start to start, pacing included), the CPU submit time(render and
+present), the time blocked on the fence of an older frame, the pacing sleep and the GPU
+completion latency(end of the submit to the fence being seen signaled, fences are polled every
+frame so it's as precise as the frame time). A CPU bound loop barely waits, a GPU bound one
+spends most of the frame waiting for fences.
+"""
+import time
+from collections import deque
+
+import numpy as np
+import OpenGL.GL as gl
+
+SIGNALED = [gl.GL_ALREADY_SIGNALED, gl.GL_CONDITION_SATISFIED]
+
+
+class FrameTiming:
+  def __init__(self, frame, start):
+    self.frame = frame
+    self.start = start
+    self.interval = None
+    self.sleep = 0.0
+    self.wait = 0.0
+    self.submit = 0.0
+    self.submitted = None
+    self.latency = None
+    self.fence = None
+
+
+class FrameLoop:
+  """
+  target_fps None runs unbounded(benchmark mode). history is the number of frames kept for
+  the statistics
+  """
+
+  def __init__(self, global_state, frames_in_flight=2, target_fps=None, history=100000):
+    assert(frames_in_flight >= 1)
+    self.global_state = global_state
+    self.frames_in_flight = frames_in_flight
+    self.target_fps = target_fps
+    self.history = deque(maxlen=history)
+    self.in_flight = deque()
+    self.deadline = None
+    self.last_start = None
+    self.frame = 0
+
+  def resolve(self, timing):
+    timing.latency = time.perf_counter() - timing.submitted
+    gl.glDeleteSync(timing.fence)
+    timing.fence = None
+
+  def poll(self):
+    """
+    Resolves the frames the GPU is done with, oldest first
+    """
+    while len(self.in_flight) != 0:
+      timing = self.in_flight[0]
+      if gl.glClientWaitSync(timing.fence, 0, 0) not in SIGNALED:
+        break
+      self.in_flight.popleft()
+      self.resolve(timing)
+
+  def wait(self, count):
+    """
+    Blocks until at most count frames are in flight
+    """
+    while len(self.in_flight) > count:
+      timing = self.in_flight.popleft()
+      while True:
+        status = gl.glClientWaitSync(timing.fence, gl.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000000)
+        if status in SIGNALED:
+          break
+        if status == gl.GL_WAIT_FAILED:
+          raise RuntimeError("glClientWaitSync failed")
+      self.resolve(timing)
+
+  def pace(self):
+    """
+    Sleeps until the next frame is due, returns the seconds slept
+    """
+    if self.target_fps == None:
+      return 0.0
+    period = 1.0 / self.target_fps
+    now = time.perf_counter()
+    if self.deadline == None or now - self.deadline > period:
+      # First frame or too far behind to catch up, start over from now
+      self.deadline = now
+    elif self.deadline > now:
+      time.sleep(self.deadline - now)
+    self.deadline += period
+    return time.perf_counter() - now
+
+  def step(self, present=None):
+    """
+    Renders a frame, present(e.g. glutSwapBuffers) is called after GlobalState.render
+    """
+    sleep = self.pace()
+    timing = FrameTiming(self.frame, time.perf_counter())
+    timing.sleep = sleep
+    if self.last_start != None:
+      timing.interval = timing.start - self.last_start
+    self.last_start = timing.start
+    self.wait(self.frames_in_flight - 1)
+    timing.wait = time.perf_counter() - timing.start
+    self.global_state.render()
+    if present != None:
+      present()
+    timing.fence = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+    # Gets the frame going on the GPU while the CPU works on the next one
+    gl.glFlush()
+    timing.submitted = time.perf_counter()
+    timing.submit = timing.submitted - timing.start - timing.wait
+    self.in_flight.append(timing)
+    self.history.append(timing)
+    self.frame += 1
+    self.poll()
+    return timing
+
+  def run(self, frames=None, seconds=None, present=None):
+    """
+    Renders until frames frames are done or seconds have passed, then waits for the GPU
+    """
+    start = time.perf_counter()
+    count = 0
+    while (frames == None or count < frames) and (
+        seconds == None or time.perf_counter() - start < seconds):
+      self.step(present)
+      count += 1
+    self.finish()
+    return self.get_stats()
+
+  def finish(self):
+    self.wait(0)
+
+  def get_stats(self):
+    """
+    Returns the frame count, fps and {mean, p50, p95, p99, max} in ms of the frame time,
+    submit, wait, pacing sleep and latency over the history. bound is "gpu" when the loop
+    spent more than a tenth of its time blocked on fences, "paced" when it spent it sleeping
+    for the target frame rate, "cpu" otherwise
+    """
+    timings = list(self.history)
+    series = {
+        "frame_ms": [t.interval for t in timings if t.interval != None],
+        "submit_ms": [t.submit for t in timings],
+        "wait_ms": [t.wait for t in timings],
+        "sleep_ms": [t.sleep for t in timings],
+        "latency_ms": [t.latency for t in timings if t.latency != None],
+    }
+    stats = {"frames": len(timings)}
+    for name, values in series.items():
+      values = np.array(values) * 1000.0
+      if len(values) == 0:
+        stats[name] = None
+        continue
+      p50, p95, p99 = np.percentile(values, [50, 95, 99])
+      stats[name] = dict(mean=float(values.mean()), p50=float(p50), p95=float(p95),
+                         p99=float(p99), max=float(values.max()))
+    frame_ms = stats["frame_ms"]
+    stats["fps"] = 1000.0 / frame_ms["mean"] if frame_ms != None else None
+    stats["bound"] = None
+    if frame_ms != None:
+      if stats["wait_ms"]["mean"] > 0.1 * frame_ms["mean"]:
+        stats["bound"] = "gpu"
+      elif stats["sleep_ms"]["mean"] > 0.1 * frame_ms["mean"]:
+        stats["bound"] = "paced"
+      else:
+        stats["bound"] = "cpu"
+    return stats
+
+  def format_stats(self):
+    stats = self.get_stats()
+    lines = ["%d frames, %s fps, bound: %s, %d in flight%s" % (
+        stats["frames"], "%.2f" % stats["fps"] if stats["fps"] != None else "-", stats["bound"],
+        self.frames_in_flight,
+        ", target %g fps" % self.target_fps if self.target_fps != None else "")]
+    lines.append("%-10s %9s %9s %9s %9s %9s" % ("ms", "mean", "p50", "p95", "p99", "max"))
+    for name in ["frame_ms", "submit_ms", "wait_ms", "sleep_ms", "latency_ms"]:
+      values = stats[name]
+      if values == None:
+        continue
+      lines.append("%-10s %9.3f %9.3f %9.3f %9.3f %9.3f" % (
+          name[:-3], values["mean"], values["p50"], values["p95"], values["p99"], values["max"]))
+    return "\n".join(lines)
+
+  def gl_release(self):
+    for timing in self.in_flight:
+      gl.glDeleteSync(timing.fence)
+      timing.fence = None
+    self.in_flight = deque()
@@ -0,0 +1,238 @@
+"""
+Headless batch rendering without a display server: a surfaceless EGL context
+(Mesa llvmpipe works on machines without a GPU) and an offscreen back buffer.
+
+  python -m renderpy.headless public/examples/multipass_test.json -n 10 -o out/frame_%04d.png
+  python -m renderpy.headless graph.json -n 100 --width 1024 --height 1024 -o frames.npz
+  python -m renderpy.headless graph.json -n 100 -o - > frames.rgba
+  python -m renderpy.headless graph.json -n 100 --profile trace.json
+  python -m renderpy.headless graph.json --benchmark --duration 60 --frames-in-flight 3
+
+.png writes one image per frame(the pattern gets the frame number), .npz writes a single
+(N, height, width, 4) uint8 array named "frames", anything else is a raw RGBA8 stream
+('-' for stdout). Rows of the images are top to bottom.
+--benchmark drives the frames through renderpy.frame_loop without reading them back and prints
+the frame time, submit, fence wait and GPU latency percentiles.
+"""
+import os
+import sys
+import time
+import ctypes
+import argparse
+import traceback
+from collections import deque
+
+# Has to happen before the first OpenGL import
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+import numpy as np
+from OpenGL import EGL
+import matplotlib.image
+
+from .renderpy import GlobalState
+from .watch import GraphWatcher
+from .frame_loop import FrameLoop
+
+
+def create_context(major=4, minor=5):
+  """
+  Creates an OpenGL core context without any surface and makes it current,
+  everything is rendered into framebuffer objects
+  """
+  display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+  if display == EGL.EGL_NO_DISPLAY:
+    raise RuntimeError("no EGL display")
+  egl_major, egl_minor = EGL.EGLint(), EGL.EGLint()
+  if not EGL.eglInitialize(display, ctypes.pointer(egl_major), ctypes.pointer(egl_minor)):
+    raise RuntimeError("eglInitialize failed")
+  EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+
+  config = EGL.EGLConfig()
+  num_configs = EGL.EGLint()
+  config_attribs = (EGL.EGLint * 5)(
+      EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+      EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+      EGL.EGL_NONE)
+  EGL.eglChooseConfig(display, config_attribs, ctypes.pointer(config), 1,
+                      ctypes.pointer(num_configs))
+  if num_configs.value == 0:
+    raise RuntimeError("no EGL config with desktop OpenGL")
+
+  context_attribs = (EGL.EGLint * 7)(
+      EGL.EGL_CONTEXT_MAJOR_VERSION, major,
+      EGL.EGL_CONTEXT_MINOR_VERSION, minor,
+      EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+      EGL.EGL_NONE)
+  context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, context_attribs)
+  if context == EGL.EGL_NO_CONTEXT:
+    raise RuntimeError("OpenGL %d.%d core context is not supported" % (major, minor))
+  if not EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context):
+    raise RuntimeError("eglMakeCurrent failed(EGL_KHR_surfaceless_context is needed)")
+  return display, context
+
+
+def destroy_context(display, context):
+  EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+  EGL.eglDestroyContext(display, context)
+  EGL.eglTerminate(display)
+
+
+def render_frames(global_state, count):
+  """
+  Renders count frames into the offscreen back buffer and yields (frame, image, seconds),
+  seconds is the time spent in GlobalState.render for the frame.
+  Readbacks are pipelined, the image of a frame is yielded while the next ones are in flight
+  """
+  pending = deque()
+  for i in range(count):
+    start = time.perf_counter()
+    global_state.render()
+    seconds = time.perf_counter() - start
+    pending.append((i, seconds, global_state.read_texture(
+        global_state.offscreen, "RGBA8", global_state.width, global_state.height)))
+    if len(pending) >= len(global_state.readback.buffers):
+      frame, seconds, readback = pending.popleft()
+      yield frame, readback.result()[::-1], seconds
+  while len(pending) != 0:
+    frame, seconds, readback = pending.popleft()
+    yield frame, readback.result()[::-1], seconds
+
+
+class FrameWriter:
+  def __init__(self, output):
+    self.output = output
+    self.frames = []
+    self.stream = None
+    if output.endswith(".png") and "%" not in output:
+      self.output = output[:-len(".png")] + "_%04d.png"
+    if not output.endswith(".png") and not output.endswith(".npz"):
+      self.stream = sys.stdout.buffer if output == "-" else open(output, "wb")
+
+  def write(self, frame, image):
+    if self.output.endswith(".png"):
+      filename = self.output % frame
+      if os.path.dirname(filename) != "":
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+      matplotlib.image.imsave(filename, image)
+    elif self.output.endswith(".npz"):
+      self.frames.append(image.copy())
+    else:
+      self.stream.write(image.tobytes())
+
+  def close(self):
+    if self.output.endswith(".npz"):
+      np.savez_compressed(self.output, frames=np.array(self.frames))
+    elif self.stream != None and self.stream is not sys.stdout.buffer:
+      self.stream.close()
+
+
+def watch(global_state, filename, writer, first):
+  """
+  Renders a frame after every change of the graph file, until interrupted.
+  Frames are numbered from first on
+  """
+  watcher = GraphWatcher(global_state, filename)
+  index = first
+  print("watching %s" % filename, file=sys.stderr)
+  try:
+    while True:
+      start = time.perf_counter()
+      try:
+        changes = watcher.poll()
+        if changes == None:
+          time.sleep(watcher.interval)
+          continue
+        for frame, image, seconds in render_frames(global_state, 1):
+          if writer != None:
+            writer.write(index, image)
+      except KeyboardInterrupt:
+        raise
+      except Exception:
+        # Keep watching, the next save may fix it
+        traceback.print_exc()
+        continue
+      added, removed = changes
+      print("reload %d: %d nodes added, %d removed, %d rebuilt, frame %d in %.2f ms" % (
+          watcher.reloads, len(added), len(removed), len(global_state.rebuilt), index,
+          (time.perf_counter() - start) * 1000.0), file=sys.stderr)
+      index += 1
+  except KeyboardInterrupt:
+    pass
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description="Renders a graph without a display server")
+  parser.add_argument("graph")
+  parser.add_argument("-n", "--frames", type=int, default=1)
+  parser.add_argument("--width", type=int, default=512)
+  parser.add_argument("--height", type=int, default=512)
+  parser.add_argument("-o", "--output", default=None,
+                      help=".png pattern, .npz file or raw RGBA8 stream('-' for stdout)")
+  parser.add_argument("--program-cache", default=None,
+                      help="directory for the compiled program binaries")
+  parser.add_argument("--model-cache", default=None,
+                      help="directory for the converted models")
+  parser.add_argument("--optimize-models", action="store_true",
+                      help="optimize the models for the vertex cache(see renderpy.mesh_opt)")
+  parser.add_argument("-q", "--quiet", action="store_true", help="don't print per-frame timing")
+  parser.add_argument("--profile", default=None,
+                      help="profiles every node, saves a Chrome trace and prints the summary")
+  parser.add_argument("--watch", action="store_true",
+                      help="keeps running, renders a frame whenever the graph file changes")
+  parser.add_argument("--benchmark", action="store_true",
+                      help="renders without readback and prints frame pacing statistics")
+  parser.add_argument("--frames-in-flight", type=int, default=2,
+                      help="frames queued on the GPU in benchmark mode")
+  parser.add_argument("--fps", type=float, default=None,
+                      help="target frame rate in benchmark mode, unbounded by default")
+  parser.add_argument("--duration", type=float, default=None,
+                      help="benchmark for that many seconds instead of -n frames")
+  args = parser.parse_args(argv)
+  if args.benchmark and (args.output != None or args.watch):
+    parser.error("--benchmark doesn't write frames")
+
+  display, context = create_context()
+  try:
+    global_state = GlobalState(args.program_cache, args.model_cache,
+                               optimize_models=args.optimize_models)
+    global_state.load_json(args.graph)
+    global_state.set_offscreen(args.width, args.height)
+    if args.profile != None:
+      global_state.enable_profiler()
+    if args.benchmark:
+      loop = FrameLoop(global_state, args.frames_in_flight, args.fps)
+      loop.run(args.frames if args.duration == None else None, args.duration)
+      print(loop.format_stats(), file=sys.stderr)
+      loop.gl_release()
+      args.frames = 0
+    writer = FrameWriter(args.output) if args.output != None else None
+    times = []
+    start = time.perf_counter()
+    for frame, image, seconds in render_frames(global_state, args.frames):
+      if writer != None:
+        writer.write(frame, image)
+      times.append(seconds * 1000.0)
+      if not args.quiet:
+        print("frame %d %.2f ms" % (frame, seconds * 1000.0), file=sys.stderr)
+    total = time.perf_counter() - start
+    if args.watch:
+      watch(global_state, args.graph, writer, args.frames)
+    if writer != None:
+      writer.close()
+    if args.profile != None:
+      global_state.profiler.save_trace(args.profile)
+      print(global_state.profiler.format_summary(), file=sys.stderr)
+    global_state.gl_release()
+  finally:
+    destroy_context(display, context)
+
+  if len(times) != 0:
+    times = np.array(times)
+    print("%d frames %dx%d: render mean %.2f ms, min %.2f ms, max %.2f ms, %.2f fps overall" % (
+        len(times), args.width, args.height, times.mean(), times.min(), times.max(),
+        len(times) / total), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
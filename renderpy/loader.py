@@ -0,0 +1,85 @@
+import re
+import json
+
+import numpy as np
+
+# Flat arrays of numbers, the payloads in config.srcs are mostly made of those
+NUMERIC_ARRAY = re.compile(r'\[[-+0-9.eE,\s]*\]')
+PLACEHOLDER = "__array_%d__"
+
+FORMAT_DTYPES = {
+    "RGBA32F": np.float32,
+    "RGBA32UI": np.uint32,
+    "RGBA8UN": np.uint8,
+}
+
+TYPE_DTYPES = {
+    "float": np.float32,
+    "vec2": np.float32,
+    "vec3": np.float32,
+    "vec4": np.float32,
+    "uint16": np.uint32,
+    "uint32": np.uint32,
+}
+
+
+def decode_array(text):
+  """
+  Decodes the text of a flat JSON array of numbers in one go
+  """
+  body = text[1:-1]
+  if body.strip() == "":
+    return np.zeros(0, np.float64)
+  arr = np.fromstring(body, np.float64, sep=",")
+  if len(arr) != body.count(",") + 1:
+    # Something fromstring doesn't understand(e.g. trailing comma), take the slow path
+    arr = np.array(json.loads(text), np.float64)
+  return arr
+
+
+def get_dtype(d):
+  if "format" in d and d["format"] in FORMAT_DTYPES:
+    return FORMAT_DTYPES[d["format"]]
+  if "type" in d and d["type"] in TYPE_DTYPES:
+    return TYPE_DTYPES[d["type"]]
+  return None
+
+
+def restore_arrays(d, arrays):
+  """
+  Puts the decoded arrays back in place of the placeholders,
+  casting them to the dtype implied by the sibling "format"/"type" keys
+  """
+  if isinstance(d, dict):
+    dtype = get_dtype(d)
+    for key, value in d.items():
+      if isinstance(value, str) and value in arrays:
+        arr = arrays[value]
+        if dtype != None:
+          arr = arr.astype(dtype)
+        d[key] = arr
+      else:
+        restore_arrays(value, arrays)
+  elif isinstance(d, list):
+    for i, item in enumerate(d):
+      if isinstance(item, str) and item in arrays:
+        d[i] = arrays[item]
+      else:
+        restore_arrays(item, arrays)
+  return d
+
+
+def parse_payload(text):
+  """
+  Parses a JSON payload(texture, vertex buffer) from config.srcs.
+  The numeric arrays are decoded straight into contiguous NumPy arrays, json only sees the skeleton
+  """
+  arrays = {}
+
+  def replace(match):
+    name = PLACEHOLDER % len(arrays)
+    arrays[name] = decode_array(match.group(0))
+    return '"' + name + '"'
+
+  skeleton = NUMERIC_ARRAY.sub(replace, text)
+  return restore_arrays(json.loads(skeleton), arrays)
@@ -0,0 +1,195 @@
+import numpy as np
+import OpenGL.GL as gl
+
+from .state import create_object
+
+# Attribute types to the number of float components
+VERTEX_COMPONENTS = {
+    "float": 1,
+    "vec2": 2,
+    "vec3": 3,
+    "vec4": 4,
+}
+
+# DrawElementsIndirectCommand
+DRAW_COMMAND = np.dtype([
+    ("count", np.uint32),
+    ("instance_count", np.uint32),
+    ("first_index", np.uint32),
+    ("base_vertex", np.int32),
+    ("base_instance", np.uint32),
+])
+
+
+def create_buffer(data):
+  buf = create_object(gl.glCreateBuffers)
+  gl.glNamedBufferStorage(buf, data.nbytes, data, 0)
+  return buf
+
+
+def get_vertex_count(mesh):
+  for attrib in mesh.attributes.values():
+    return len(attrib.data) // VERTEX_COMPONENTS[attrib.type]
+  return 0
+
+
+class GPUMesh:
+  """
+  GPU copy of the meshes of a source packed into shared buffers: one buffer per attribute
+  stream with the meshes back to back, uploaded the first time a layout consumes it, and one
+  index buffer. ranges holds (index count, first index, base vertex) per mesh.
+  instances is the optional AD(count, attributes) of per-instance streams
+  """
+
+  def __init__(self, meshes, instances):
+    self.meshes = meshes
+    self.instances = instances
+    self.streams = {}
+    self.size = 0
+    self.ranges = []
+    indices = [np.asarray(mesh.get_index_data().data) for mesh in meshes]
+    # Indices are relative to the base vertex of their mesh, 16 bit ones stay 16 bit
+    dtype = np.uint16 if all(data.dtype == np.uint16 for data in indices) else np.uint32
+    first_index = 0
+    base_vertex = 0
+    for mesh, data in zip(meshes, indices):
+      self.ranges.append((len(data), first_index, base_vertex))
+      first_index += len(data)
+      base_vertex += get_vertex_count(mesh)
+    self.index_buffer = self.upload(np.concatenate(indices).astype(dtype, copy=False))
+    self.index_type = gl.GL_UNSIGNED_SHORT if dtype == np.uint16 else gl.GL_UNSIGNED_INT
+    self.vaos = 0
+
+  def upload(self, data):
+    data = np.ascontiguousarray(data)
+    self.size += data.nbytes
+    return create_buffer(data)
+
+  def get_stream(self, name, divisor):
+    key = (name, divisor)
+    buf = self.streams.get(key)
+    if buf == None:
+      if divisor == 0:
+        arrays = [mesh.get_attrib_data(name).data for mesh in self.meshes]
+      else:
+        arrays = [self.instances.attributes[name].data]
+      buf = self.upload(np.concatenate(arrays).astype(np.float32, copy=False))
+      self.streams[key] = buf
+    return buf
+
+  def gl_release(self):
+    for buf in self.streams.values():
+      gl.glDeleteBuffers(1, buf)
+    gl.glDeleteBuffers(1, self.index_buffer)
+    self.streams = {}
+
+
+class VertexArray:
+  """
+  VAO over a GPUMesh, a single mesh is drawn with glDrawElementsInstanced and several with
+  one glMultiDrawElementsIndirect from the indirect buffer
+  """
+
+  def __init__(self, arr, gpu_mesh, instance_count):
+    self.arr = arr
+    self.ranges = gpu_mesh.ranges
+    self.index_type = gpu_mesh.index_type
+    self.instance_count = instance_count
+    self.indirect_buffer = None
+    if len(self.ranges) > 1:
+      commands = np.array([(count, instance_count, first_index, base_vertex, 0)
+                           for count, first_index, base_vertex in self.ranges], DRAW_COMMAND)
+      self.indirect_buffer = create_buffer(commands)
+
+  def draw(self, state):
+    state.bind_vertex_array(self.arr)
+    if self.indirect_buffer == None:
+      gl.glDrawElementsInstanced(gl.GL_TRIANGLES, self.ranges[0][0], self.index_type, None,
+                                 self.instance_count)
+    else:
+      state.bind_buffer(gl.GL_DRAW_INDIRECT_BUFFER, self.indirect_buffer)
+      gl.glMultiDrawElementsIndirect(gl.GL_TRIANGLES, self.index_type, None,
+                                     len(self.ranges), 0)
+
+  def gl_release(self, state):
+    state.delete_vertex_array(self.arr)
+    if self.indirect_buffer != None:
+      state.delete_buffer(self.indirect_buffer)
+
+
+class MeshCache:
+  """
+  Meshes uploaded once per source and shared by all the draw calls.
+  key identifies the mesh source(see get_mesh_key of the mesh nodes), a VAO is built per
+  (key, layout, instance count) where layout is the tuple of
+  (attribute name, location, components, divisor) the pipeline consumes.
+  Unreferenced entries are deleted by collect(), so a draw call that is released and
+  initialized again within an update keeps its buffers
+  """
+
+  def __init__(self, state):
+    self.state = state
+    self.meshes = {}
+    self.vaos = {}  # (key, layout, instance count) -> [VertexArray, refcount]
+    self.uploads = 0
+
+  def acquire(self, key, meshes, layout, instances=None, instance_count=1):
+    """
+    Returns the VertexArray of the meshes for the layout, uploads what is missing
+    """
+    vao_key = (key, layout, instance_count)
+    entry = self.vaos.get(vao_key)
+    if entry != None:
+      entry[1] += 1
+      return entry[0]
+    gpu_mesh = self.meshes.get(key)
+    if gpu_mesh == None:
+      gpu_mesh = GPUMesh(meshes, instances)
+      self.meshes[key] = gpu_mesh
+      self.uploads += 1
+    vao = create_object(gl.glCreateVertexArrays)
+    for binding, (name, loc, comps, divisor) in enumerate(layout):
+      gl.glVertexArrayVertexBuffer(vao, binding, gpu_mesh.get_stream(name, divisor), 0,
+                                   comps * 4)
+      gl.glVertexArrayBindingDivisor(vao, binding, divisor)
+      gl.glVertexArrayAttribFormat(vao, loc, comps, gl.GL_FLOAT, False, 0)
+      gl.glVertexArrayAttribBinding(vao, loc, binding)
+      gl.glEnableVertexArrayAttrib(vao, loc)
+    gl.glVertexArrayElementBuffer(vao, gpu_mesh.index_buffer)
+    gpu_mesh.vaos += 1
+    info = VertexArray(vao, gpu_mesh, instance_count)
+    self.vaos[vao_key] = [info, 1]
+    return info
+
+  def release(self, key, layout, instance_count=1):
+    self.vaos[(key, layout, instance_count)][1] -= 1
+
+  def collect(self):
+    """
+    Deletes the VAOs nobody references anymore and the meshes without VAOs
+    """
+    for vao_key, (info, refcount) in list(self.vaos.items()):
+      if refcount > 0:
+        continue
+      info.gl_release(self.state)
+      del self.vaos[vao_key]
+      self.meshes[vao_key[0]].vaos -= 1
+    for key, gpu_mesh in list(self.meshes.items()):
+      if gpu_mesh.vaos == 0:
+        gpu_mesh.gl_release()
+        del self.meshes[key]
+
+  def get_stats(self):
+    return dict(meshes=len(self.meshes),
+                vaos=len(self.vaos),
+                buffers=sum(len(mesh.streams) + 1 for mesh in self.meshes.values()),
+                bytes=sum(mesh.size for mesh in self.meshes.values()),
+                uploads=self.uploads)
+
+  def gl_release(self):
+    for info, refcount in self.vaos.values():
+      info.gl_release(self.state)
+    for gpu_mesh in self.meshes.values():
+      gpu_mesh.gl_release()
+    self.vaos = {}
+    self.meshes = {}
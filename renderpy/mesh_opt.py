@@ -0,0 +1,155 @@
+"""
+Mesh optimization: duplicate vertex merging, triangle reordering for the post-transform
+vertex cache(Tipsify, Sander et al. 2007), vertex reordering for fetch locality and 16 bit
+indices when the vertex count allows.
+
+Meshes are {"attributes": {name: {"data", "type"}}, "indices": {"data", "type"}} with flat
+arrays, as produced by renderpy.assets and the VertexBufferNode payloads.
+"""
+from collections import deque
+
+import numpy as np
+
+from .mesh_cache import VERTEX_COMPONENTS
+
+CACHE_SIZE = 16
+
+
+def get_acmr(indices, cache_size=CACHE_SIZE):
+  """
+  Average cache miss ratio: vertex shader invocations per triangle with a FIFO cache
+  """
+  if len(indices) < 3:
+    return 0.0
+  fifo = deque()
+  cached = set()
+  misses = 0
+  for v in np.asarray(indices).tolist():
+    if v in cached:
+      continue
+    misses += 1
+    fifo.append(v)
+    cached.add(v)
+    if len(fifo) > cache_size:
+      cached.discard(fifo.popleft())
+  return misses / (len(indices) // 3)
+
+
+def get_streams(attributes):
+  """
+  Returns [(name, type, (vertex count, components) float32 array)]
+  """
+  streams = []
+  for name, attrib in attributes.items():
+    comps = VERTEX_COMPONENTS[attrib["type"]]
+    data = np.asarray(attrib["data"], np.float32).reshape(-1, comps)
+    streams.append((name, attrib["type"], data))
+  return streams
+
+
+def dedup_vertices(streams, indices):
+  """
+  Merges the vertices whose attributes are bitwise equal, returns (streams, indices)
+  """
+  rows = np.ascontiguousarray(np.hstack([data for name, type, data in streams]))
+  keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+  unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+  streams = [(name, type, data[first]) for name, type, data in streams]
+  return streams, inverse.ravel()[indices]
+
+
+def tipsify(indices, vertex_count, cache_size=CACHE_SIZE):
+  """
+  Reorders the triangles for the post-transform cache, returns the new index array
+  """
+  triangle_count = len(indices) // 3
+  # Vertex -> triangles adjacency in CSR form
+  order = np.argsort(indices, kind="stable")
+  adjacency = (order // 3).tolist()
+  valence = np.bincount(indices, minlength=vertex_count)
+  offsets = np.concatenate([[0], np.cumsum(valence)]).tolist()
+  triangles = indices.reshape(-1, 3).tolist()
+  live = valence.tolist()
+  cache_time = [0] * vertex_count
+  emitted = bytearray(triangle_count)
+  dead_end = []
+  output = []
+  timestamp = cache_size + 1
+  cursor = 0
+  fanning = 0 if vertex_count != 0 else -1
+  while fanning >= 0:
+    candidates = []
+    for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+      if emitted[t]:
+        continue
+      emitted[t] = 1
+      for v in triangles[t]:
+        output.append(v)
+        dead_end.append(v)
+        candidates.append(v)
+        live[v] -= 1
+        if timestamp - cache_time[v] > cache_size:
+          cache_time[v] = timestamp
+          timestamp += 1
+    # Next fanning vertex: the candidate still in the cache after its remaining triangles
+    fanning = -1
+    best = -1
+    for v in candidates:
+      if live[v] == 0:
+        continue
+      priority = 0
+      if timestamp - cache_time[v] + 2 * live[v] <= cache_size:
+        priority = timestamp - cache_time[v]
+      if priority > best:
+        best = priority
+        fanning = v
+    if fanning == -1:
+      while len(dead_end) != 0:
+        v = dead_end.pop()
+        if live[v] > 0:
+          fanning = v
+          break
+    if fanning == -1:
+      while cursor < vertex_count:
+        if live[cursor] > 0:
+          fanning = cursor
+          break
+        cursor += 1
+  return np.array(output, indices.dtype)
+
+
+def reorder_vertices(streams, indices):
+  """
+  Renumbers the vertices in the order the indices reference them first, drops unreferenced ones
+  """
+  used, first = np.unique(indices, return_index=True)
+  order = used[np.argsort(first)]
+  remap = np.zeros(len(streams[0][2]), np.int64)
+  remap[order] = np.arange(len(order))
+  streams = [(name, type, data[order]) for name, type, data in streams]
+  return streams, remap[indices]
+
+
+def optimize_mesh(attributes, indices, cache_size=CACHE_SIZE):
+  """
+  Returns (attributes, indices, stats), the input is left untouched.
+  stats has the vertex counts and the ACMR before and after
+  """
+  index_data = np.asarray(indices["data"], np.int64)
+  streams = get_streams(attributes)
+  assert(len(streams) != 0)
+  stats = {
+      "vertices_before": len(streams[0][2]),
+      "acmr_before": get_acmr(index_data, cache_size),
+  }
+  streams, index_data = dedup_vertices(streams, index_data)
+  index_data = tipsify(index_data, len(streams[0][2]), cache_size)
+  streams, index_data = reorder_vertices(streams, index_data)
+  vertex_count = len(streams[0][2])
+  index_type = "uint16" if vertex_count <= 0x10000 else "uint32"
+  attributes = dict((name, {"data": data.ravel(), "type": type}) for name, type, data in streams)
+  indices = {"data": index_data.astype(np.uint16 if index_type == "uint16" else np.uint32),
+             "type": index_type}
+  stats["vertices_after"] = vertex_count
+  stats["acmr_after"] = get_acmr(index_data, cache_size)
+  return attributes, indices, stats
@@ -0,0 +1,194 @@
+"""
+Per node CPU and GPU profiling of GlobalState.render, enabled with GlobalState.enable_profiler().
+
+CPU time is measured per node and phase(init, render, release, draw), GPU time per node render
+and draw call with GL_TIMESTAMP queries. The queries of a frame are read back once they are
+available(a few frames later), so profiling doesn't stall the pipeline.
+"""
+import json
+import time
+import ctypes
+from collections import deque
+from contextlib import contextmanager
+
+import OpenGL.GL as gl
+
+
+class FrameRecord:
+  def __init__(self, frame):
+    self.frame = frame
+    self.cpu = []  # (label, phase, start, seconds)
+    self.gpu = []  # (label, phase, begin query, end query)
+    self.gpu_reference = None  # (GL timestamp ns, perf_counter) at the start of the frame
+
+
+class Profiler:
+  """
+  history is the number of frames in the rolling summary, max_events caps the trace size.
+  Frames with queries still in flight after `latency` frames are waited on
+  """
+
+  def __init__(self, history=120, latency=3, max_events=1000000):
+    self.history = deque(maxlen=history)
+    self.latency = latency
+    self.max_events = max_events
+    self.events = []
+    self.pending = deque()
+    self.free_queries = []
+    self.all_queries = []
+    self.record = None
+    self.origin = time.perf_counter()
+
+  def get_query(self):
+    if len(self.free_queries) == 0:
+      query = int(gl.glGenQueries(1)[0])
+      self.all_queries.append(query)
+      return query
+    return self.free_queries.pop()
+
+  def timestamp(self):
+    query = self.get_query()
+    gl.glQueryCounter(query, gl.GL_TIMESTAMP)
+    return query
+
+  def begin_frame(self, frame):
+    self.record = FrameRecord(frame)
+    value = ctypes.c_int64()
+    gl.glGetInteger64v(gl.GL_TIMESTAMP, ctypes.byref(value))
+    self.record.gpu_reference = (value.value, time.perf_counter())
+    self.record.start = time.perf_counter()
+
+  def end_frame(self):
+    record = self.record
+    self.record = None
+    record.cpu.append(("frame", "frame", record.start,
+                       time.perf_counter() - record.start))
+    self.pending.append(record)
+    self.poll()
+
+  @contextmanager
+  def scope(self, node, phase, gpu=False):
+    """
+    Measures the body, outside of begin_frame/end_frame only the CPU time is recorded
+    """
+    record = self.record
+    gpu = gpu and record != None
+    label = node.get_label()
+    if gpu:
+      begin = self.timestamp()
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      seconds = time.perf_counter() - start
+      if gpu:
+        record.gpu.append((label, phase, begin, self.timestamp()))
+      if record != None:
+        record.cpu.append((label, phase, start, seconds))
+      else:
+        self.add_events([(label, phase, start, seconds)], 0)
+        self.add_summary([(label, phase, seconds, None)])
+
+  def is_available(self, record):
+    if len(record.gpu) == 0:
+      return True
+    query = record.gpu[-1][3]
+    return gl.glGetQueryObjectiv(query, gl.GL_QUERY_RESULT_AVAILABLE) != 0
+
+  def get_query_result(self, query):
+    value = ctypes.c_int64()
+    gl.glGetQueryObjecti64v(query, gl.GL_QUERY_RESULT, ctypes.byref(value))
+    return value.value
+
+  def poll(self, wait=False):
+    """
+    Resolves the frames whose queries are available, oldest first
+    """
+    while len(self.pending) != 0:
+      record = self.pending[0]
+      if not (wait or len(self.pending) > self.latency or self.is_available(record)):
+        break
+      self.pending.popleft()
+      self.resolve(record)
+
+  def resolve(self, record):
+    gpu_ns, cpu_reference = record.gpu_reference
+    gpu = []
+    for label, phase, begin, end in record.gpu:
+      begin_ns = self.get_query_result(begin)
+      end_ns = self.get_query_result(end)
+      self.free_queries.extend([begin, end])
+      gpu.append((label, phase, cpu_reference + (begin_ns - gpu_ns) * 1.0e-9,
+                  (end_ns - begin_ns) * 1.0e-9))
+    self.add_events(record.cpu, 0)
+    self.add_events(gpu, 1)
+    # A node can run several times per frame(e.g. a draw call shared by passes)
+    summary = {}
+    for label, phase, start, seconds in record.cpu:
+      summary.setdefault((label, phase), [0.0, None])[0] += seconds
+    for label, phase, start, seconds in gpu:
+      entry = summary.setdefault((label, phase), [0.0, None])
+      entry[1] = (entry[1] or 0.0) + seconds
+    self.add_summary([(label, phase, cpu, gpu) for (label, phase), (cpu, gpu) in summary.items()])
+
+  def add_events(self, events, tid):
+    for label, phase, start, seconds in events:
+      if len(self.events) >= self.max_events:
+        return
+      self.events.append({
+          "name": label, "cat": phase, "ph": "X", "pid": 0, "tid": tid,
+          "ts": (start - self.origin) * 1.0e6, "dur": seconds * 1.0e6,
+      })
+
+  def add_summary(self, entries):
+    self.history.append(entries)
+
+  def get_summary(self):
+    """
+    Returns [(label, phase, frames, mean cpu ms, mean gpu ms or None)] over the rolling history,
+    slowest first
+    """
+    totals = {}
+    for entries in self.history:
+      for label, phase, cpu, gpu in entries:
+        total = totals.setdefault((label, phase), [0, 0.0, 0, 0.0])
+        total[0] += 1
+        total[1] += cpu
+        if gpu != None:
+          total[2] += 1
+          total[3] += gpu
+    rows = []
+    for (label, phase), (count, cpu, gpu_count, gpu) in totals.items():
+      rows.append((label, phase, count, cpu * 1000.0 / count,
+                   gpu * 1000.0 / gpu_count if gpu_count != 0 else None))
+    rows.sort(key=lambda row: -max(row[3], row[4] or 0.0))
+    return rows
+
+  def format_summary(self):
+    lines = ["%-32s %-8s %7s %10s %10s" % ("node", "phase", "frames", "cpu ms", "gpu ms")]
+    for label, phase, count, cpu, gpu in self.get_summary():
+      lines.append("%-32s %-8s %7d %10.3f %10s" % (
+          label[:32], phase, count, cpu, "%.3f" % gpu if gpu != None else "-"))
+    return "\n".join(lines)
+
+  def get_trace(self):
+    """
+    Chrome trace / Perfetto JSON, CPU events on thread 0 and GPU events on thread 1
+    """
+    self.poll(wait=True)
+    metadata = [
+        {"name": "thread_name", "ph": "M", "pid": 0, "tid": 0, "args": {"name": "CPU"}},
+        {"name": "thread_name", "ph": "M", "pid": 0, "tid": 1, "args": {"name": "GPU"}},
+    ]
+    return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+  def save_trace(self, filename):
+    with open(filename, "w") as f:
+      json.dump(self.get_trace(), f)
+
+  def gl_release(self):
+    self.poll(wait=True)
+    if len(self.all_queries) != 0:
+      gl.glDeleteQueries(len(self.all_queries), self.all_queries)
+    self.all_queries = []
+    self.free_queries = []
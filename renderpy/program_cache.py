@@ -0,0 +1,164 @@
+import os
+import ctypes
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import OpenGL.GL as gl
+from OpenGL.GL import shaders
+
+
+class ProgramCache:
+  """
+  Linked GLSL programs keyed by the hash of the sources and the driver string.
+  Programs that are not referenced anymore stay alive in a LRU list of `capacity` entries.
+  With `path` set the program binaries are also persisted on disk(glGetProgramBinary),
+  so that a warm start doesn't compile anything.
+  """
+
+  def __init__(self, path=None, capacity=64, state=None):
+    self.path = path
+    self.state = state
+    self.capacity = capacity
+    self.driver = None
+    self.entries = {}  # key -> [program, refcount]
+    self.program2key = {}
+    self.lru = OrderedDict()  # unreferenced keys
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+  def get_driver(self):
+    if self.driver == None:
+      self.driver = b"|".join([
+          gl.glGetString(gl.GL_VENDOR),
+          gl.glGetString(gl.GL_RENDERER),
+          gl.glGetString(gl.GL_VERSION),
+      ])
+    return self.driver
+
+  def get_key(self, vs_source, ps_source):
+    h = hashlib.sha1()
+    h.update(self.get_driver())
+    for src in [vs_source, ps_source]:
+      h.update(b"\0")
+      h.update(src.encode() if isinstance(src, str) else src)
+    return h.hexdigest()
+
+  def acquire(self, vs_source, ps_source):
+    """
+    Returns a linked program, the reference must be given back with release()
+    """
+    key = self.get_key(vs_source, ps_source)
+    entry = self.entries.get(key)
+    if entry != None:
+      self.hits += 1
+      if entry[1] == 0:
+        del self.lru[key]
+      entry[1] += 1
+      return entry[0]
+    program = self.load_binary(key)
+    if program != None:
+      self.disk_hits += 1
+    else:
+      self.misses += 1
+      program = self.compile(vs_source, ps_source)
+      self.store_binary(key, program)
+    self.entries[key] = [program, 1]
+    self.program2key[program] = key
+    return program
+
+  def release(self, program):
+    key = self.program2key[program]
+    entry = self.entries[key]
+    assert(entry[1] > 0)
+    entry[1] -= 1
+    if entry[1] == 0:
+      self.lru[key] = None
+      while len(self.lru) > self.capacity:
+        old_key, _ = self.lru.popitem(last=False)
+        old_program = self.entries.pop(old_key)[0]
+        del self.program2key[old_program]
+        self.delete_program(old_program)
+
+  def compile(self, vs_source, ps_source):
+    vs = shaders.compileShader(vs_source, gl.GL_VERTEX_SHADER)
+    ps = shaders.compileShader(ps_source, gl.GL_FRAGMENT_SHADER)
+    program = gl.glCreateProgram()
+    gl.glAttachShader(program, vs)
+    gl.glAttachShader(program, ps)
+    if self.path != None:
+      gl.glProgramParameteri(
+          program, gl.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, gl.GL_TRUE)
+    gl.glLinkProgram(program)
+    gl.glDetachShader(program, vs)
+    gl.glDetachShader(program, ps)
+    gl.glDeleteShader(vs)
+    gl.glDeleteShader(ps)
+    if gl.glGetProgramiv(program, gl.GL_LINK_STATUS) != gl.GL_TRUE:
+      log = gl.glGetProgramInfoLog(program)
+      gl.glDeleteProgram(program)
+      raise RuntimeError("Link failure: %s" % log)
+    return program
+
+  def get_binary_path(self, key):
+    return os.path.join(self.path, key + ".bin")
+
+  def load_binary(self, key):
+    if self.path == None:
+      return None
+    filename = self.get_binary_path(key)
+    if not os.path.exists(filename):
+      return None
+    data = np.fromfile(filename, np.uint8)
+    if len(data) < 4:
+      return None
+    format = int(data[:4].view(np.uint32)[0])
+    binary = data[4:]
+    program = gl.glCreateProgram()
+    gl.glProgramBinary(program, format, binary, len(binary))
+    if gl.glGetProgramiv(program, gl.GL_LINK_STATUS) != gl.GL_TRUE:
+      # Driver rejected the binary, just compile it again
+      gl.glDeleteProgram(program)
+      return None
+    return program
+
+  def store_binary(self, key, program):
+    if self.path == None:
+      return
+    length = gl.glGetProgramiv(program, gl.GL_PROGRAM_BINARY_LENGTH)
+    if length <= 0:
+      return
+    binary = np.empty(length, np.uint8)
+    written = gl.GLsizei(0)
+    format = gl.GLenum(0)
+    gl.glGetProgramBinary(program, length, ctypes.byref(written),
+                          ctypes.byref(format), binary)
+    os.makedirs(self.path, exist_ok=True)
+    filename = self.get_binary_path(key)
+    # Write to a temporary file first so that concurrent processes never see a partial binary
+    tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(tmp_filename, "wb") as f:
+      f.write(np.uint32([format.value]).tobytes())
+      f.write(binary[:written.value].tobytes())
+    os.replace(tmp_filename, filename)
+
+  def delete_program(self, program):
+    if self.state != None:
+      self.state.delete_program(program)
+    else:
+      gl.glDeleteProgram(program)
+
+  def get_stats(self):
+    return dict(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+                programs=len(self.entries), unreferenced=len(self.lru))
+
+  def clear(self):
+    """
+    Deletes all the programs, must be called with the context still alive
+    """
+    for program, _ in self.entries.values():
+      self.delete_program(program)
+    self.entries = {}
+    self.program2key = {}
+    self.lru = OrderedDict()
@@ -0,0 +1,140 @@
+import ctypes
+
+import numpy as np
+import OpenGL.GL as gl
+
+from .state import create_object
+
+# Format name to (pixel format, pixel type, dtype, channels), textures are read as they are stored
+READ_FORMATS = {
+    "RGBA8": (gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, np.uint8, 4),
+    "RGBA8UN": (gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, np.uint8, 4),
+    "RGBA32F": (gl.GL_RGBA, gl.GL_FLOAT, np.float32, 4),
+    "RGBA32UI": (gl.GL_RGBA_INTEGER, gl.GL_UNSIGNED_INT, np.uint32, 4),
+    "D16": (gl.GL_DEPTH_COMPONENT, gl.GL_FLOAT, np.float32, 1),
+    "D32": (gl.GL_DEPTH_COMPONENT, gl.GL_FLOAT, np.float32, 1),
+}
+
+
+def get_read_shape(format, width, height):
+  channels = READ_FORMATS[format][3]
+  if channels == 1:
+    return (height, width)
+  return (height, width, channels)
+
+
+class Readback:
+  """
+  Pending copy of a texture, result() waits for the GPU and fills the array.
+  Rows are in GL order: row 0 is the bottom row of the texture
+  """
+
+  def __init__(self, ring, slot, out):
+    self.ring = ring
+    self.slot = slot
+    self.out = out
+    self.fence = None
+    self.resolved = False
+
+  def done(self):
+    if self.resolved:
+      return True
+    status = gl.glClientWaitSync(self.fence, 0, 0)
+    return status in [gl.GL_ALREADY_SIGNALED, gl.GL_CONDITION_SATISFIED]
+
+  def result(self, timeout=None):
+    """
+    timeout is in seconds, None waits as long as it takes
+    """
+    if self.resolved:
+      return self.out
+    flags = gl.GL_SYNC_FLUSH_COMMANDS_BIT
+    wait = 0xFFFFFFFFFFFFFFFF if timeout == None else int(timeout * 1e9)
+    while True:
+      status = gl.glClientWaitSync(self.fence, flags, wait)
+      if status in [gl.GL_ALREADY_SIGNALED, gl.GL_CONDITION_SATISFIED]:
+        break
+      if status == gl.GL_WAIT_FAILED:
+        raise RuntimeError("glClientWaitSync failed")
+      if timeout != None:
+        raise TimeoutError("readback is not ready after %s s" % timeout)
+      flags = 0
+    self.ring.resolve(self)
+    return self.out
+
+
+class ReadbackRing:
+  """
+  Ring of pixel buffer objects for asynchronous texture readback.
+  read() queues glGetTextureImage into the next buffer and returns a Readback right away.
+  The copy into the array happens when the result is asked for, or when the ring wraps
+  around to the buffer and the previous readback has to make room
+  """
+
+  def __init__(self, size=3):
+    self.buffers = [None] * size
+    self.sizes = [0] * size
+    self.pending = [None] * size
+    self.next = 0
+
+  def get_buffer(self, slot, size):
+    if self.buffers[slot] == None:
+      self.buffers[slot] = create_object(gl.glCreateBuffers)
+    if self.sizes[slot] < size:
+      gl.glNamedBufferData(self.buffers[slot], size, None, gl.GL_STREAM_READ)
+      self.sizes[slot] = size
+    return self.buffers[slot]
+
+  def read(self, tex, format, width, height, out=None):
+    """
+    Queues the readback of a whole texture in its native format,
+    out is an optional preallocated array of get_read_shape(format, width, height)
+    """
+    if format not in READ_FORMATS:
+      raise RuntimeError("unknown format %s" % format)
+    pixel_format, pixel_type, dtype, channels = READ_FORMATS[format]
+    shape = get_read_shape(format, width, height)
+    if out is None:
+      out = np.empty(shape, dtype)
+    elif out.shape != shape or out.dtype != dtype or not out.flags.c_contiguous:
+      raise ValueError("out must be a contiguous %s array of shape %s" % (
+          np.dtype(dtype).name, shape))
+
+    slot = self.next
+    self.next = (self.next + 1) % len(self.buffers)
+    if self.pending[slot] != None:
+      self.pending[slot].result()
+
+    buf = self.get_buffer(slot, out.nbytes)
+    gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buf)
+    gl.glGetTextureImage(tex, 0, pixel_format, pixel_type, out.nbytes, ctypes.c_void_p(0))
+    gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+
+    readback = Readback(self, slot, out)
+    readback.fence = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+    self.pending[slot] = readback
+    return readback
+
+  def resolve(self, readback):
+    gl.glGetNamedBufferSubData(self.buffers[readback.slot], 0, readback.out.nbytes, readback.out)
+    gl.glDeleteSync(readback.fence)
+    readback.fence = None
+    readback.resolved = True
+    if self.pending[readback.slot] is readback:
+      self.pending[readback.slot] = None
+
+  def flush(self):
+    """
+    Completes all the pending readbacks
+    """
+    for readback in self.pending:
+      if readback != None:
+        readback.result()
+
+  def gl_release(self):
+    self.flush()
+    for buf in self.buffers:
+      if buf != None:
+        gl.glDeleteBuffers(1, buf)
+    self.buffers = [None] * len(self.buffers)
+    self.sizes = [0] * len(self.buffers)
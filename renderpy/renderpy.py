@@ -5,6 +5,11 @@ import matplotlib.cbook as cbook
 from matplotlib.path import Path
 from matplotlib.patches import PathPatch
 import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 import OpenGL
 from OpenGL.GL import shaders
@@ -14,11 +19,21 @@ from OpenGL.GL.framebufferobjects import *
 from OpenGL.GL.EXT.multi_draw_arrays import *
 from OpenGL.GL.ARB.imaging import *
 
-def glDrawBuffers(buf):
-  try:
-      gl.glDrawBuffers(buf)
-  except OpenGL.GL.GLError as err:
-    assert err.err == 1280
+from .program_cache import ProgramCache
+from .blit import Blitter
+from .scheduler import Scheduler
+from .loader import parse_payload
+from .bundle import Bundle
+from .state import GLState, create_texture
+from .rt_pool import RenderTargetPool
+from .readback import ReadbackRing
+from .profiler import Profiler
+from .mesh_cache import MeshCache, VERTEX_COMPONENTS
+from .assets import ModelCache
+from .mesh_opt import optimize_mesh, CACHE_SIZE
+from .commands import CommandList, PassCommand, DrawCommand, NodeCommand
+from .uniforms import (GL_TYPE_NAMES, FRAME_BLOCK, DRAW_BLOCK, FRAME_BINDING, DRAW_BINDING,
+                       FRAME_LAYOUT, FRAME_SIZE, UniformBlock, reflect_block, set_uniform)
 
 # Attribute dictionary
 # used to hack python into making javascript like objects-dictionaries
@@ -27,6 +42,48 @@ class AD(dict):
   __setattr__ = dict.__setitem__
 
 
+class LazyAD(AD):
+  """
+  AD that wraps the nested dictionaries and lists on access instead of converting
+  the whole document upfront. Wrapped values are stored back so identity is stable
+  """
+
+  def __getitem__(self, key):
+    value = dict.__getitem__(self, key)
+    if type(value) is dict:
+      value = LazyAD(value)
+      dict.__setitem__(self, key, value)
+    elif type(value) is list:
+      value = LazyList(value)
+      dict.__setitem__(self, key, value)
+    return value
+
+  def get(self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  __getattr__ = __getitem__
+
+
+class LazyList(list):
+  def __getitem__(self, i):
+    value = list.__getitem__(self, i)
+    if isinstance(i, slice):
+      return value
+    if type(value) is dict:
+      value = LazyAD(value)
+      list.__setitem__(self, i, value)
+    elif type(value) is list:
+      value = LazyList(value)
+      list.__setitem__(self, i, value)
+    return value
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+
 def replace_dict(d):
   if isinstance(d, dict):
     d = AD(d)
@@ -46,16 +103,56 @@ class Node:
     self.id = json_node.id
     global_state.id2node[self.id] = self
     self.global_state = global_state
-    self.title = json_node.title
-    self.outputs = []
-    self.inputs = []
     self.is_recursive = False
-    for o in json_node.outputs:
-      self.outputs.append(o)
-    for o in json_node.inputs:
-      self.inputs.append(o)
+    self.is_sink = False
+    # Output changes every frame(see GlobalState.plan_targets)
+    self.is_dynamic = False
+    # Retained mode bookkeeping, see GlobalState.render
+    self.gl_signature = None
+    self.gl_version = 0
+    # Executed gl_render calls and the inputs of the last one, see GlobalState.get_render_signature
+    self.render_count = 0
+    self.gl_result = None
+    self.reload(json_node)
+
+  def reload(self, json_node):
+    """
+    Takes the title, slots and properties of a new version of the node, GL resources are
+    rebuilt by the next update if the signature changed
+    """
+    self.title = json_node.title
+    self.outputs = list(json_node.outputs)
+    self.inputs = list(json_node.inputs)
     self.properties = json_node.properties
 
+  def get_signature(self):
+    """
+    Returns a value that changes whenever the GL resources of the node have to be rebuilt:
+    properties, referenced sources in config.srcs, incoming links and the versions of the input nodes
+    """
+    srcs = []
+    for value in self.properties.values():
+      if isinstance(value, str) and value in self.global_state.json.config.srcs:
+        srcs.append(self.global_state.get_src_key(value))
+    links = []
+    for o in self.inputs:
+      link_id = o.link
+      if link_id:
+        link = self.global_state.id2link[link_id]
+        origin = self.global_state.id2node[link.origin_node_id]
+        links.append((o.name, link.origin_node_id, link.origin_slot,
+                      0 if origin.is_recursive else origin.gl_version))
+    return (json.dumps(self.properties, sort_keys=True), tuple(srcs), tuple(links))
+
+  def get_label(self):
+    return "%s(%s)" % (self.title, self.id)
+
+  def invalidate(self):
+    """
+    Drops CPU side data derived from properties/sources so that it's parsed again
+    """
+    pass
+
   def get_output_by_name(self, name):
     i = 0
     for o in self.outputs:
@@ -124,44 +221,135 @@ class PipelineNode(Node):
     assert("vs" in self.properties and "ps" in self.properties)
 
   def get_uniform_location(self, name):
-    return gl.glGetUniformLocation(self.gl.program, name)
+    uniform = self.gl.uniforms.get(name)
+    return uniform[0] if uniform != None else -1
 
   def gl_init(self):
     self.gl = AD()
     vs_source = self.global_state.get_src(self.properties.vs)
     ps_source = self.global_state.get_src(self.properties.ps)
-    self.gl.program = shaders.compileProgram(shaders.compileShader(
-        vs_source, gl.GL_VERTEX_SHADER), shaders.compileShader(ps_source, gl.GL_FRAGMENT_SHADER))
+    self.gl.program = self.global_state.program_cache.acquire(vs_source, ps_source)
+    self.reflect()
+    self.check_interface()
+    # The Frame block changes every frame, so do the passes drawing with the pipeline
+    self.is_dynamic = self.gl.frame_block
+
+  def reflect(self):
+    """
+    Builds name -> (location, type, size) tables of the active uniforms and attributes,
+    assigns texture units to the samplers, in the order the program reports them,
+    and binds the uniform blocks(see renderpy.uniforms)
+    """
+    program = self.gl.program
+    self.gl.uniforms = {}
+    for i in range(gl.glGetProgramiv(program, gl.GL_ACTIVE_UNIFORMS)):
+      name, size, type = gl.glGetActiveUniform(program, i)
+      name = name.decode()
+      if name.endswith("[0]"):
+        name = name[:-3]
+      loc = gl.glGetUniformLocation(program, name)
+      if loc < 0:
+        # Uniform block members
+        continue
+      self.gl.uniforms[name] = (loc, int(type), int(size))
+    self.gl.attributes = {}
+    for i in range(gl.glGetProgramiv(program, gl.GL_ACTIVE_ATTRIBUTES)):
+      name, size, type = gl.glGetActiveAttrib(program, i)
+      name = name.decode()
+      loc = gl.glGetAttribLocation(program, name)
+      if loc < 0:
+        # Built-ins like gl_VertexID
+        continue
+      self.gl.attributes[name] = (loc, int(type), int(size))
+    self.gl.texture_units = {}
+    for name, (loc, type, size) in self.gl.uniforms.items():
+      if GL_TYPE_NAMES.get(type) == "texture":
+        unit = len(self.gl.texture_units)
+        self.gl.texture_units[name] = unit
+        gl.glProgramUniform1i(program, loc, unit)
+    self.gl.frame_block = False
+    frame_block = reflect_block(program, FRAME_BLOCK)
+    if frame_block != None:
+      index, size, members = frame_block
+      for name, member in members.items():
+        expected = FRAME_LAYOUT.get(name)
+        if expected == None or expected[:2] != member[:2]:
+          raise RuntimeError("%s(%d): %s %s doesn't match the std140 %s block of renderpy.uniforms" % (
+              self.title, self.id, member[0], name, FRAME_BLOCK))
+      gl.glUniformBlockBinding(program, index, FRAME_BINDING)
+      self.gl.frame_block = True
+    # name -> (type name, offset, array size, array stride, matrix stride)
+    self.gl.draw_uniforms = {}
+    self.gl.draw_block_size = 0
+    draw_block = reflect_block(program, DRAW_BLOCK)
+    if draw_block != None:
+      index, self.gl.draw_block_size, self.gl.draw_uniforms = draw_block
+      gl.glUniformBlockBinding(program, index, DRAW_BINDING)
+
+  def check_interface(self):
+    """
+    Checks the declared uniforms/attributes against the linked program.
+    Declared but inactive ones are fine, the compiler is free to drop them
+    """
+    for kind, declared, active in [
+            ("uniform", self.properties.get("uniforms"), self.gl.uniforms),
+            ("attribute", self.properties.get("attributes"), self.gl.attributes)]:
+      for item in declared or []:
+        if kind == "uniform" and item.name in self.gl.draw_uniforms:
+          type_name = self.gl.draw_uniforms[item.name][0]
+        elif item.name not in active:
+          continue
+        else:
+          type_name = GL_TYPE_NAMES.get(active[item.name][1])
+        if type_name != item.type:
+          raise RuntimeError("%s(%d): %s %s is declared as %s, the program has %s" % (
+              self.title, self.id, kind, item.name, item.type, type_name))
 
   def bind(self):
-    gl.glUseProgram(self.gl.program)
-    gl.glDisable(gl.GL_CULL_FACE)
-    gl.glFrontFace(gl.GL_CW)
-    gl.glDepthMask(True)
-    gl.glEnable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_SCISSOR_TEST)
-    gl.glDepthFunc(gl.GL_LEQUAL)
-    gl.glDisable(gl.GL_BLEND)
-    gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE)
+    state = self.global_state.state
+    state.use_program(self.gl.program)
+    state.disable(gl.GL_CULL_FACE)
+    state.front_face(gl.GL_CW)
+    state.depth_mask(True)
+    state.enable(gl.GL_DEPTH_TEST)
+    state.disable(gl.GL_SCISSOR_TEST)
+    state.depth_func(gl.GL_LEQUAL)
+    state.disable(gl.GL_BLEND)
+    state.blend_func(gl.GL_ONE, gl.GL_ONE)
 
   def get_attrib_location(self, name):
-    return gl.glGetAttribLocation(self.gl.program, name)
+    attribute = self.gl.attributes.get(name)
+    return attribute[0] if attribute != None else -1
 
   def gl_release(self):
     if self.gl.program != None:
-      gl.glDeleteProgram(self.gl.program)
+      self.global_state.program_cache.release(self.gl.program)
     self.gl = AD()
 
   def get_info(self):
+    """
+    Returns the declared interface, falls back to the reflected one when the editor didn't declare it
+    """
     info = AD()
-    info.attributes = self.properties.attributes
-    info.uniforms = self.properties.uniforms
+    info.attributes = self.properties.get("attributes")
+    info.uniforms = self.properties.get("uniforms")
+    if info.attributes == None:
+      info.attributes = [AD(name=name, type=GL_TYPE_NAMES.get(type))
+                         for name, (loc, type, size) in self.gl.attributes.items()]
+    if info.uniforms == None:
+      info.uniforms = [AD(name=name, type=GL_TYPE_NAMES.get(type))
+                       for name, (loc, type, size) in self.gl.uniforms.items()
+                       if not name.startswith("_")]
+      info.uniforms += [AD(name=name, type=member[0])
+                        for name, member in self.gl.draw_uniforms.items()
+                        if not name.startswith("_")]
     return info
 
 
 class BackBufferNode(Node):
   def __init__(self, global_state, json_node):
     super().__init__(global_state, json_node)
+    self.is_sink = True
 
   def gl_render(self):
     in_node = self.getInputNodeByName("in")
@@ -170,17 +358,13 @@ class BackBufferNode(Node):
     input_link = self.getInputLinkByName("in")
     tex = in_node.get_texture(input_link.origin_slot)
 
-    gl.glDisable(gl.GL_CULL_FACE)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_SCISSOR_TEST)
-    gl.glDepthFunc(gl.GL_LEQUAL)
-    gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE)
-
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
-    glDrawBuffers([gl.GL_BACK])
-    gl.glViewport(0, 0, self.global_state.width, self.global_state.height)
-    gl.glClearColor(0, 0, 1, 1)
+    state = self.global_state.state
+    fb, draw_buffer = self.global_state.get_backbuffer()
+    state.bind_framebuffer(fb)
+    state.draw_buffers([draw_buffer])
+    state.viewport(0, 0, self.global_state.width, self.global_state.height)
+    state.clear_color(0, 0, 1, 1)
+    state.depth_mask(True)
     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
     self.global_state.render_texture(tex, "RGBA32F", True)
 
@@ -188,6 +372,7 @@ class BackBufferNode(Node):
 class FrameCountNode(Node):
   def __init__(self, global_state, json_node):
     super().__init__(global_state, json_node)
+    self.is_dynamic = True
 
   def get_value(self, slot):
     return self.global_state.frame_count
@@ -197,7 +382,7 @@ class Mesh:
   def __init__(self):
     self.attributes = AD({})
     self.indices = AD({})
-    pass
+    self.material = AD({})
 
   def init(self, attributes, indices):
     self.attributes = attributes
@@ -209,12 +394,25 @@ class Mesh:
   def get_index_data(self):
     return self.indices
 
-  def init_gltf(self, mesh):
-    self.attributes.position = AD(data=np.float32(mesh.vertices.flatten()), type="vec3")
-    self.attributes.normal = AD(data=np.float32(mesh.vertex_normals.flatten()), type="vec3")
-    self.attributes.uv = AD(data=np.float32(mesh.visual.uv.flatten()), type="vec2")
-    self.indices = AD(data=np.uint32(mesh.faces.flatten()), type="uint32")
-    self.material = mesh.visual.material
+  def optimize(self, cache_size=CACHE_SIZE):
+    """
+    Merges duplicate vertices, reorders triangles and vertices for the vertex cache and
+    fetch locality and switches to 16 bit indices when possible. Returns the stats(ACMR)
+    """
+    attributes, indices, stats = optimize_mesh(self.attributes, self.indices, cache_size)
+    self.init(replace_dict(attributes), replace_dict(indices))
+    return stats
+
+  def init_asset(self, mesh_dict):
+    """
+    Initializes from a converted model mesh, see renderpy.assets
+    """
+    self.init(replace_dict(mesh_dict["attributes"]), replace_dict(mesh_dict["indices"]))
+    self.material = replace_dict(mesh_dict["material"])
+
+
+DEFAULT_MODEL = "models/LeePerrySmith/LeePerrySmith.gltf"
+
 
 class ModelNode(Node):
   def __init__(self, global_state, json_node):
@@ -223,59 +421,89 @@ class ModelNode(Node):
     self.meshes = None
 
   def load(self):
-    import trimesh
     self.meshes = []
-    # from pygltflib import GLTF2, Scene
-    # trimesh.util.attach_to_log()
-    scene = trimesh.load(self.global_state.fileroot + 'models/LeePerrySmith/LeePerrySmith.gltf')
-    # scene = trimesh.load(self.global_state.fileroot + 'head_lee_perry_smith/scene.gltf')
-    for name, geom in scene.geometry.items():
+    for mesh_dict in self.global_state.load_model(self.get_path()):
       mesh = Mesh()
-      mesh.init_gltf(geom)
+      mesh.init_asset(mesh_dict)
       self.meshes.append(mesh)
-    #   print (len(mesh.vertices))
-    #   print (len(mesh.vertex_normals))
-    #   print (len(mesh.faces))
-    #   print (len(mesh.visual.uv))
-    #   print (len(mesh.visual.material))
-    #   print (mesh.visual)
-    # scene.show()
-    # filename = "public/models/head_lee_perry_smith/scene.gltf"
-    # gltf = GLTF2().load(filename)
-    # print(gltf.meshes[0].primitives[0].attributes)
-    # exit()
+
+  def get_path(self):
+    """
+    fileurl is relative to the file root, graphs without one show the default model
+    """
+    fileurl = self.properties.fileurl
+    if fileurl == None:
+      fileurl = DEFAULT_MODEL
+    if "://" in fileurl:
+      raise RuntimeError("Only local models are supported: %s" % fileurl)
+    return os.path.join(self.global_state.fileroot, fileurl.lstrip("/"))
+
+  def prefetch(self):
+    try:
+      self.global_state.prefetch_model(self.get_path())
+    except RuntimeError:
+      # Reported when the node loads
+      pass
+
+  def get_mesh_key(self):
+    """
+    Identifies the meshes in the GPU mesh cache, nodes loading the same content share them
+    """
+    return ("model", self.global_state.model_cache.get_key(self.get_path()))
 
   def get_meshes(self):
     if self.meshes == None:
       self.load()
     return self.meshes
 
+  def invalidate(self):
+    self.meshes = None
+
 
 class VertexBufferNode(Node):
   def __init__(self, global_state, json_node):
     super().__init__(global_state, json_node)
     assert("src" in self.properties)
     self.mesh = None
+    self.instances = None
 
   def parse_src(self):
     if self.properties.src == None:
       return
 
-    text = self.global_state.get_src(self.properties.src)
-    if text == None:
+    json_dict = self.global_state.get_payload(self.properties.src)
+    if json_dict == None:
       self.properties.src = None
       return
 
-    json_dict = replace_dict(json.loads(text))
     mesh = Mesh()
     mesh.init(json_dict.attributes, json_dict.indices)
     self.mesh = mesh
+    # Optional per-instance streams: {"count": N, "attributes": {name: {"data", "type"}}}
+    self.instances = json_dict.get("instances")
+
+  def prefetch(self):
+    self.global_state.prefetch_payload(self.properties.src)
+
+  def get_mesh_key(self):
+    if self.properties.src == None:
+      return ("src", None)
+    return ("src", self.global_state.get_src_key(self.properties.src))
 
   def get_meshes(self):
     if self.mesh == None:
       self.parse_src()
     return [self.mesh]
 
+  def get_instances(self):
+    if self.mesh == None:
+      self.parse_src()
+    return self.instances
+
+  def invalidate(self):
+    self.mesh = None
+    self.instances = None
+
 
 class TextureBufferNode(Node):
   def __init__(self, global_state, json_node):
@@ -285,36 +513,37 @@ class TextureBufferNode(Node):
   def get_buffer(self, slot):
     return self.buf
 
+  def prefetch(self):
+    self.global_state.prefetch_payload(self.properties.src)
+
   def parse_src(self):
     if self.properties.src == None:
       return
 
-    text = self.global_state.get_src(self.properties.src)
-    # print(text)
-    if text == None:
+    self.buf = self.global_state.get_payload(self.properties.src)
+    if self.buf == None:
       self.properties.src = None
-      return
-
-    self.buf = replace_dict(json.loads(text))
 
   def get_texture(self, loc):
     return self.gl.texture
 
+  def invalidate(self):
+    if hasattr(self, "buf"):
+      del self.buf
+
   def gl_init(self):
     if not hasattr(self, "buf"):
       self.parse_src()
     if self.buf == None:
       return
-    texture = gl.glGenTextures(1)
+    texture = create_texture()
     self.gl = AD()
     self.gl.texture = texture
-    gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
 
     level = 0
     internalFormat = gl.GL_RGBA32F
     width = self.buf.width
     height = self.buf.height
-    border = 0
     format = gl.GL_RGBA
     type = gl.GL_FLOAT
     data = None
@@ -322,33 +551,23 @@ class TextureBufferNode(Node):
       type = gl.GL_FLOAT
       internalFormat = gl.GL_RGBA32F
       format = gl.GL_RGBA
-      data = np.float32(self.buf.data)
+      data = np.ascontiguousarray(self.buf.data, np.float32)
     elif self.buf.format == "RGBA32UI":
       type = gl.GL_UNSIGNED_INT
       internalFormat = gl.GL_RGBA32UI
       format = gl.GL_RGBA_INTEGER
-      data = np.uint32(self.buf.data)
+      data = np.ascontiguousarray(self.buf.data, np.uint32)
     else:
       raise 'Unsupported format. Please add!'
 
-    gl.glTexImage2D(gl.GL_TEXTURE_2D, level, internalFormat, width, height, border,
-                    format, type, data)
-
-    # gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_BASE_LEVEL, 0)
-    # gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAX_LEVEL, Math.log2(width))
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-    # gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+    gl.glTextureStorage2D(texture, 1, internalFormat, width, height)
+    gl.glTextureSubImage2D(texture, level, 0, 0, width, height,
+                           format, type, data)
+    # Filtering comes from the sampler objects bound with the texture
 
   def gl_release(self):
     if hasattr(self, "gl") and self.gl.texture != None:
-      gl.glDeleteTextures(1, self.gl.texture)
+      self.global_state.state.delete_texture(self.gl.texture)
     self.gl = AD()
 
 
@@ -368,147 +587,199 @@ class DrawCallNode(Node):
 
     mesh_input = self.getInputNodeByName("mesh")
     assert(mesh_input != None)
-    self.gl = AD()
-    self.gl.arrays = []
-    self.gl.buffers = []
     meshes = mesh_input.get_meshes()
-    for mesh in meshes:
-      assert(mesh != None)
-      mesh_info = AD()
-      arr = gl.glGenVertexArrays(1)
-      gl.glBindVertexArray(arr)
-
-      for i, attrib in enumerate(self.attributes):
-        out_attrib = mesh.get_attrib_data(attrib.name)
-        assert(out_attrib != None)
+    assert(len(meshes) != 0 and all(mesh != None for mesh in meshes))
+    instances = None
+    if hasattr(mesh_input, 'get_instances'):
+      instances = mesh_input.get_instances()
+    instance_count = self.properties.get("instances")
+    if instance_count == None:
+      instance_count = instances.count if instances != None else 1
+
+    # Only the attributes the program consumes are uploaded and bound,
+    # the ones the meshes don't have come from the per-instance streams
+    layout = []
+    for attrib in self.attributes:
+      assert(attrib.type in VERTEX_COMPONENTS)
+      comps = VERTEX_COMPONENTS[attrib.type]
+      divisor = 0
+      if all(attrib.name in mesh.attributes for mesh in meshes):
+        for mesh in meshes:
+          assert(mesh.get_attrib_data(attrib.name).type == attrib.type)
+      else:
+        assert(instances != None and attrib.name in instances.attributes)
+        out_attrib = instances.attributes[attrib.name]
         assert(out_attrib.type == attrib.type)
-        data = out_attrib.data
-        gl_buffer = gl.glGenBuffers(1)
-        self.gl.buffers.append(gl_buffer)
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, gl_buffer)
-        gl.glBufferData(gl.GL_ARRAY_BUFFER,
-                        np.float32(data), gl.GL_STATIC_DRAW)
-        loc = pipeline.get_attrib_location(attrib.name)
-        if loc < 0:
-          # print("[WARNING] Unused attribute:", attrib.name)
-          continue
-        comps = -1
-        if attrib.type == "vec2":
-          comps = 2
-        elif attrib.type == "vec3":
-          comps = 3
-        else:
-          raise "unrecognized type"
-
-        gl.glVertexAttribPointer(loc, comps, gl.GL_FLOAT, False, 0, GLvoidp(0))
-        gl.glEnableVertexAttribArray(loc)
-
-      buf = mesh.get_index_data()
-      assert("data" in buf)
-      indexBuffer = gl.glGenBuffers(1)
-      gl.glBindBuffer(gl.GL_ELEMENT_ARRAY_BUFFER, indexBuffer)
-      self.gl.buffers.append(indexBuffer)
-      # assert(buf.type == "uint32")
-      gl.glBufferData(
-          gl.GL_ELEMENT_ARRAY_BUFFER,
-          np.uint32(buf.data),
-          gl.GL_STATIC_DRAW
-      )
-      
-      mesh_info.arr = arr
-      mesh_info.draw_size = len(buf.data)
-
-      mesh_info.index_type = gl.GL_UNSIGNED_INT
-      self.gl.arrays.append(mesh_info)
+        assert(len(out_attrib.data) // comps >= instance_count)
+        divisor = 1
+      loc = pipeline.get_attrib_location(attrib.name)
+      if loc < 0:
+        # print("[WARNING] Unused attribute:", attrib.name)
+        continue
+      layout.append((attrib.name, loc, comps, divisor))
+    for mesh in meshes:
+      assert("data" in mesh.get_index_data())
+
+    # All the meshes of the source go out in a single (multi) draw
+    self.gl = AD()
+    self.gl.mesh_key = mesh_input.get_mesh_key()
+    self.gl.layout = tuple(layout)
+    self.gl.instance_count = instance_count
+    self.gl.array = self.global_state.mesh_cache.acquire(
+        self.gl.mesh_key, meshes, self.gl.layout, instances, instance_count)
+    # Values of the members of the Draw block, uploaded when they change
+    if pipeline.gl.draw_block_size != 0:
+      self.gl.block = UniformBlock(pipeline.gl.draw_block_size, pipeline.gl.draw_uniforms)
 
   def gl_draw(self):
     pipeline = self.getInputNodeByName("pipeline")
     assert(pipeline != None)
     pipeline.bind()
-    tu_cnt = 0
-
-    if True:
-      loc = pipeline.get_uniform_location("_resolution")
-      if loc >= 0:
-        viewport = gl.glGetIntegerv(gl.GL_VIEWPORT)
-        gl.glUniform2fv(loc, 1, [viewport[2] - viewport[0],
-                                 viewport[3] - viewport[1]])
-
-    for i, uni in enumerate(self.uniforms):
-      loc = pipeline.get_uniform_location(uni.name)
-      if loc < 0:
+    state = self.global_state.state
+    sampler = state.get_sampler()
+    uniforms = pipeline.gl.uniforms
+    texture_units = pipeline.gl.texture_units
+    block = self.gl.get("block")
+
+    if "_resolution" in uniforms:
+      # Set by the pass being rendered
+      x, y, width, height = state.viewport_rect
+      gl.glUniform2f(uniforms["_resolution"][0], width, height)
+
+    for uni in self.uniforms:
+      uniform = uniforms.get(uni.name)
+      if uniform == None and (block == None or uni.name not in block.members):
         continue
-      tu = tu_cnt
-      if uni.type == "texture":
-        gl.glActiveTexture(gl.GL_TEXTURE0 + tu)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
-        gl.glUniform1i(loc, tu)
-        tu_cnt += 1
-
       input = self.getInputNodeByName(uni.name)
-      if input == None:
-        continue
-      input_link = self.getInputLinkByName(uni.name)
       if uni.type == "texture":
-        texture = input.get_texture(input_link.origin_slot)
-        gl.glActiveTexture(gl.GL_TEXTURE0 + tu)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
-        gl.glTexParameteri(
-            gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
-        gl.glTexParameteri(
-            gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-        gl.glTexParameteri(
-            gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-        gl.glTexParameteri(
-            gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-        gl.glUniform1i(loc, tu)
+        unit = texture_units[uni.name]
+        if input == None:
+          state.bind_texture(unit, 0)
+          continue
+        input_link = self.getInputLinkByName(uni.name)
+        state.bind_texture(unit, input.get_texture(input_link.origin_slot))
+        state.bind_sampler(unit, sampler)
       else:
+        if input == None:
+          continue
+        input_link = self.getInputLinkByName(uni.name)
         val = input.get_value(input_link.origin_slot)
-        if uni.type == "int":
-          gl.glUniform1i(loc, val)
+        if uniform == None:
+          block.set(uni.name, val)
         else:
-          raise "Unimplemented"
+          set_uniform(uniform[0], uni.type, val)
+    if block != None:
+      block.upload()
+      state.bind_buffer_base(gl.GL_UNIFORM_BUFFER, DRAW_BINDING, block.buffer)
 
-    for arr in self.gl.arrays:
-      gl.glBindVertexArray(arr.arr)
-      gl.glDrawElements(gl.GL_TRIANGLES, arr.draw_size, arr.index_type, None)
+    self.gl.array.draw(state)
+
+  def compile_draw(self, width, height):
+    """
+    Returns the DrawCommand replaying gl_draw in a width x height pass(see GlobalState.compile)
+    """
+    pipeline = self.getInputNodeByName("pipeline")
+    uniforms = pipeline.gl.uniforms
+    block = self.gl.get("block")
+    command = DrawCommand(pipeline.bind, self.gl.array, self.gl_version)
+    command.block = block
+    if "_resolution" in uniforms:
+      command.resolution = (uniforms["_resolution"][0], width, height)
+    sampler = self.global_state.state.get_sampler()
+    for uni in self.uniforms:
+      uniform = uniforms.get(uni.name)
+      if uniform == None and (block == None or uni.name not in block.members):
+        continue
+      input = self.getInputNodeByName(uni.name)
+      if uni.type == "texture":
+        unit = pipeline.gl.texture_units[uni.name]
+        if input == None:
+          command.textures.append((unit, 0, None, 0, None))
+          continue
+        slot = self.getInputLinkByName(uni.name).origin_slot
+        command.origins.append(input)
+        if input.is_recursive:
+          # FeedbackNode hands out another texture of its history every frame
+          command.textures.append((unit, None, input.get_texture, slot, sampler))
+        else:
+          command.textures.append((unit, input.get_texture(slot), None, slot, sampler))
+      elif input != None:
+        slot = self.getInputLinkByName(uni.name).origin_slot
+        if uniform == None:
+          command.block_values.append((uni.name, input.get_value, slot))
+        else:
+          command.values.append((uniform[0], uni.type, input.get_value, slot))
+    return command
 
   def gl_release(self):
-    for arr in self.gl.arrays:
-      gl.glDeleteVertexArrays(1, arr.arr)
-    for buf in self.gl.buffers:
-      gl.glDeleteBuffers(1, buf)
+    if "array" in self.gl:
+      self.global_state.mesh_cache.release(self.gl.mesh_key, self.gl.layout,
+                                           self.gl.instance_count)
+    if "block" in self.gl:
+      self.gl.block.gl_release(self.global_state.state)
     self.gl = AD()
 
 
 class FeedbackNode(Node):
+  """
+  Exposes the previous frames of its input: slot 0 is the last frame, slot k the one k frames
+  before it(properties.history frames are kept, 1 by default).
+  The history is a ring of persistent textures matching the source target, every frame costs
+  one copy into the oldest one
+  """
+
   def __init__(self, global_state, json_node):
     super().__init__(global_state, json_node)
     self.is_recursive = True
+    self.is_dynamic = True
     self.gl = AD()
-    self.gl.tex = None
+    self.gl.history = []
+    self.gl.desc = None
+
+  def get_history_size(self):
+    if "history" in self.properties and self.properties.history != None:
+      return max(1, int(self.properties.history))
+    return 1
+
+  def get_source_desc(self):
+    input = self.getInputNodeByName("in")
+    if input == None or not hasattr(input, 'get_target_desc'):
+      return ("RGBA8", 1, 1)
+    return input.get_target_desc(self.getInputLinkByName("in").origin_slot)
 
   def reset(self):
-    if self.gl.tex != None:
-      gl.glDeleteTextures(1, self.gl.tex)
-    self.gl.tex = gl.glGenTextures(1)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, self.gl.tex)
-    gl.glTexStorage2D(gl.GL_TEXTURE_2D, 1, gl.GL_RGBA8, 1, 1)
+    """
+    (Re)creates the history textures for the current source, cleared to zero
+    """
+    self.gl_release()
+    desc = self.get_source_desc()
+    rt_pool = self.global_state.rt_pool
+    for i in range(0, self.get_history_size()):
+      tex = rt_pool.acquire(*desc)
+      rt_pool.clear_texture(tex)
+      self.gl.history.append(tex)
+    self.gl.desc = desc
 
   def get_texture(self, slot):
-    if self.gl.tex == None:
+    if self.gl.desc != self.get_source_desc():
       self.reset()
-    return self.gl.tex
+    return self.gl.history[slot % len(self.gl.history)]
 
   def gl_render(self):
-    if self.gl.tex != None:
-      gl.glDeleteTextures(1, self.gl.tex)
-    self.gl = AD(tex=None)
     input_link = self.getInputLinkByName("in")
     if input_link == None:
       return
-    self.gl.tex = self.getInputNodeByName(
-        "in").clone_texture(input_link.origin_slot)
+    if self.gl.desc != self.get_source_desc():
+      self.reset()
+    # Every reader of the history is done, the oldest frame becomes the newest
+    tex = self.gl.history.pop()
+    self.getInputNodeByName("in").copy_texture(input_link.origin_slot, tex)
+    self.gl.history.insert(0, tex)
+
+  def gl_release(self):
+    for tex in self.gl.history:
+      self.global_state.rt_pool.release(tex)
+    self.gl = AD(history=[], desc=None)
 
 
 class PassNodeGL:
@@ -527,90 +798,73 @@ class PassNode(Node):
         "rts" in self.properties or "depth" in self.properties))
 
   def gl_render(self):
-    gl.glPushDebugGroup(gl.GL_DEBUG_SOURCE_APPLICATION, 0, 4, "Pass")
+    gl.glPushDebugGroup(gl.GL_DEBUG_SOURCE_APPLICATION, 0, -1, self.get_label())
     self.bind()
     for i, input in enumerate(self.inputs):
       if input["type"] == "drawcall_t":
         node = self.get_input_node_by_slot(i)
         if node != None:
-          node.gl_draw()
+          gl.glPushDebugGroup(gl.GL_DEBUG_SOURCE_APPLICATION, 0, -1, node.get_label())
+          with self.global_state.profile(node, "draw", gpu=True):
+            node.gl_draw()
+          gl.glPopDebugGroup()
     gl.glPopDebugGroup()
 
+  def compile_pass(self, cacheable):
+    """
+    Returns the PassCommand replaying gl_render(see GlobalState.compile)
+    """
+    draws = []
+    for i, input in enumerate(self.inputs):
+      if input["type"] == "drawcall_t":
+        node = self.get_input_node_by_slot(i)
+        if node != None:
+          draws.append(node.compile_draw(self.properties.viewport.width,
+                                         self.properties.viewport.height))
+    return PassCommand(self, draws, cacheable)
+
   def gl_init(self):
+    """
+    The textures and the framebuffer are assigned by GlobalState.plan_targets
+    """
     self.gl = PassNodeGL()
-    self.gl.fb = gl.glGenFramebuffers(1)
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.gl.fb)
     for i in range(0, len(self.properties.rts)):
-      tex = self.gen_texture(i)
-      self.gl.rts.append(tex)
       self.gl.draw_buffers.append(gl.GL_COLOR_ATTACHMENT0 + i)
-      gl.glFramebufferTexture2D(
-          gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0 + i, gl.GL_TEXTURE_2D, tex, 0)
 
-    if self.properties.depth != None:
-      tex = self.gen_texture(999)
-      self.gl.depth = tex
-      gl.glFramebufferTexture2D(
-          gl.GL_FRAMEBUFFER, gl.GL_DEPTH_ATTACHMENT, gl.GL_TEXTURE_2D, tex, 0)
-
-  def clone_texture(self, id):
-    targetTextureWidth = self.properties.viewport.width
-    targetTextureHeight = self.properties.viewport.height
-    targetTexture = self.gen_texture(id)
-    srcTexture = self.get_texture(id)
-    fb = gl.glGenFramebuffers(1)
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fb)
-    gl.glFramebufferTexture2D(
-        gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, targetTexture, 0)
-
-    gl.glDisable(gl.GL_CULL_FACE)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_SCISSOR_TEST)
-    gl.glDepthFunc(gl.GL_LEQUAL)
-    gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE)
-
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fb)
-    glDrawBuffers([gl.GL_COLOR_ATTACHMENT0])
-    gl.glViewport(0, 0, targetTextureWidth, targetTextureHeight)
-    gl.glClearColor(0, 0, 1, 1)
-    gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-
-    self.global_state.render_texture(srcTexture)
-
-    gl.glDeleteFramebuffers(1, fb)
-    return targetTexture
-
-  def gen_texture(self, id):
+  def get_target_desc(self, id):
     if id >= len(self.properties.rts):
       rt = self.properties.depth
-      tex = gl.glGenTextures(1)
-      gl.glBindTexture(gl.GL_TEXTURE_2D, tex)
-      format = None
-      if rt.format == "D16":
-        format = gl.GL_DEPTH_COMPONENT16
-      elif rt.format == "D32":
-        format = gl.GL_DEPTH_COMPONENT32F
-      else:
-        raise "unknown format"
-
-      gl.glTexStorage2D(gl.GL_TEXTURE_2D, 1, format,
-                        self.properties.viewport.width, self.properties.viewport.height)
-      return tex
+      if rt.format not in ["D16", "D32"]:
+        raise RuntimeError("unknown depth format %s" % rt.format)
     else:
       rt = self.properties.rts[id]
-      tex = gl.glGenTextures(1)
-      gl.glBindTexture(gl.GL_TEXTURE_2D, tex)
-      format = None
-      if rt.format == "RGBA8":
-        format = gl.GL_RGBA8
-      elif rt.format == "RGBA32F":
-        format = gl.GL_RGBA32F
-      else:
-        raise "unknown format"
-      gl.glTexStorage2D(gl.GL_TEXTURE_2D, 1, format,
-                        self.properties.viewport.width, self.properties.viewport.height)
-      return tex
+    return (rt.format, self.properties.viewport.width, self.properties.viewport.height)
+
+  def get_targets(self):
+    """
+    Returns the (format, width, height) of every output slot: the color targets then the depth
+    """
+    count = len(self.properties.rts)
+    if self.properties.depth != None:
+      count += 1
+    return [self.get_target_desc(i) for i in range(0, count)]
+
+  def set_targets(self, textures):
+    # New textures, whatever was rendered before is gone
+    self.gl_result = None
+    count = len(self.properties.rts)
+    self.gl.rts = textures[:count]
+    self.gl.depth = textures[count] if len(textures) > count else None
+    self.gl.fb = self.global_state.rt_pool.get_framebuffer(self.gl.rts, self.gl.depth)
+
+  def copy_texture(self, id, targetTexture):
+    """
+    Copies the target into a texture of the same format and size(see get_target_desc)
+    """
+    srcTexture = self.get_texture(id)
+    self.global_state.blitter.copy(srcTexture, targetTexture,
+                                   self.properties.viewport.width, self.properties.viewport.height,
+                                   depth=id >= len(self.properties.rts))
 
   def get_texture(self, id):
     if id >= len(self.properties.rts):
@@ -618,30 +872,44 @@ class PassNode(Node):
     return self.gl.rts[id]
 
   def bind(self):
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.gl.fb)
-    glDrawBuffers(self.gl.draw_buffers)
-    gl.glViewport(0, 0, self.properties.viewport.width,
-                  self.properties.viewport.height)
-    gl.glClearColor(0, 0, 0, 1)
-    gl.glClearDepth(1.0)
+    state = self.global_state.state
+    state.bind_framebuffer(self.gl.fb)
+    state.draw_buffers(self.gl.draw_buffers)
+    state.viewport(0, 0, self.properties.viewport.width,
+                   self.properties.viewport.height)
+    state.clear_color(0, 0, 0, 1)
+    state.clear_depth(1.0)
+    state.depth_mask(True)
     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
 
   def gl_release(self):
-    if self.gl.fb != None:
-      gl.glDeleteFramebuffers(1, self.gl.fb)
+    # The textures and the framebuffer belong to the pool
+    self.gl = PassNodeGL()
 
-    for i in range(0, len(self.gl.rts)):
-      tex = self.gl.rts[i]
-      gl.glDeleteTextures(1, tex)
 
-    if self.gl.depth != None:
-      gl.glDeleteTextures(1, self.gl.depth)
-
-    self.gl = PassNodeGL()
+NODE_TYPES = {
+    "gfx/PassNode": PassNode,
+    "gfx/BackBufferNode": BackBufferNode,
+    "gfx/DrawCallNode": DrawCallNode,
+    "gfx/PipelineNode": PipelineNode,
+    "gfx/VertexBufferNode": VertexBufferNode,
+    "gfx/ModelNode": ModelNode,
+    "gfx/TextureBufferNode": TextureBufferNode,
+    "gfx/FeedbackNode": FeedbackNode,
+    "gfx/FrameCountNode": FrameCountNode,
+}
 
 
 class GlobalState:
-  def __init__(self):
+  def __init__(self, program_cache_dir=None, model_cache_dir=None, asset_threads=None,
+               optimize_models=False):
+    """
+    asset_threads is the size of the pool decoding the assets in the background, one per
+    spare core by default(up to 4). 0 decodes them on first use on the calling thread.
+    optimize_models runs the models through renderpy.mesh_opt(cached with the model)
+    """
+    if asset_threads == None:
+      asset_threads = min(4, (os.cpu_count() or 1) - 1)
     self.nodes = []
     self.id2node = {}
     self.links = []
@@ -650,72 +918,292 @@ class GlobalState:
     self.width = 512
     self.height = 512
     self.fileroot = "public/"
-    pass
+    self.sinks = set()
+    self.scheduler = None
+    self.payloads = {}
+    self.pending_payloads = {}  # name -> (content, future)
+    self.pending_models = {}  # filename -> future
+    self.asset_executor = None
+    if asset_threads > 0:
+      self.asset_executor = ThreadPoolExecutor(asset_threads, thread_name_prefix="renderpy-assets")
+    self.bundle = None
+    self.state = GLState()
+    self.program_cache = ProgramCache(program_cache_dir, state=self.state)
+    self.blitter = Blitter(self.program_cache, self.state)
+    self.rt_pool = RenderTargetPool(self.state)
+    self.mesh_cache = MeshCache(self.state)
+    self.model_cache = ModelCache(model_cache_dir, optimize_models)
+    self.readback = ReadbackRing()
+    self.offscreen = None
+    self.planned_order = None
+    self.profiler = None
+    self.rebuilt = []
+    # Reuse the results of the static passes, see render
+    self.pass_caching = True
+    self.cacheable = set()
+    self.passes_executed = 0
+    self.passes_skipped = 0
+    # Per-frame uniforms(see renderpy.uniforms), matrices are flat and column-major.
+    # _time is the wall clock since the first frame unless time_step is set
+    self.camera = AD(view=np.identity(4, np.float32), proj=np.identity(4, np.float32))
+    self.time_step = None
+    self.start_time = None
+    self.frame_block = None
+    # Replays the command list recorded by compile instead of walking the nodes. It's
+    # recompiled when graph_version changes: loading, reloading, sinks, payloads, offscreen
+    # target. Call invalidate_commands() after editing nodes in place
+    self.replay = False
+    self.commands = None
+    self.graph_version = 0
+
+  def enable_profiler(self, **kwargs):
+    """
+    Starts profiling every node, see Profiler for the arguments
+    """
+    if self.profiler != None:
+      self.profiler.gl_release()
+    self.profiler = Profiler(**kwargs)
+    return self.profiler
+
+  def disable_profiler(self):
+    if self.profiler != None:
+      self.profiler.gl_release()
+    self.profiler = None
+
+  def profile(self, node, phase, gpu=False):
+    """
+    Returns a context manager measuring the body when profiling is enabled
+    """
+    if self.profiler == None:
+      return nullcontext()
+    return self.profiler.scope(node, phase, gpu)
 
   def toposort(self):
     """
-    Returns the list of nodes in inverse topological order
+    Returns the list of scheduled nodes in topological order
     """
-    sorted = []
-    unsorted = []
-    unsorted_set = set()
-    for node in self.nodes:
-      if node.is_recursive:
-        continue
-      unsorted_set.add(node.id)
-      unsorted.append(node)
-    while len(unsorted_set) != 0:
-      node = unsorted.pop(0)
-      is_ready = True
-      for id in node.get_input_ids():
-        if id in unsorted_set:
-          is_ready = False
-          break
-      if is_ready:
-        sorted.append(node)
-        unsorted_set.remove(node.id)
-      else:
-        unsorted.append(node)
-    for node in self.nodes:
-      if node.is_recursive:
-        sorted.append(node)
-    return sorted
+    if self.scheduler == None:
+      self.reschedule()
+    return self.scheduler.order
+
+  def reschedule(self):
+    """
+    Rebuilds the adjacency and the node order, needed after the links or the sinks change
+    """
+    sinks = [node.id for node in self.nodes if node.is_sink]
+    sinks.extend(self.sinks)
+    self.scheduler = Scheduler(self.nodes, self.id2link, sinks)
+
+  def add_sink(self, node_id):
+    """
+    Keeps the node and everything it depends on scheduled, e.g. for get_texture_data
+    """
+    self.sinks.add(node_id)
+    self.scheduler = None
+    self.graph_version += 1
+
+  def remove_sink(self, node_id):
+    self.sinks.discard(node_id)
+    self.scheduler = None
+    self.graph_version += 1
 
   def get_src(self, name):
     return self.json.config.srcs[name].code
 
+  def get_src_key(self, name):
+    """
+    Returns a value that changes with the content of the source
+    """
+    src = self.json.config.srcs[name]
+    if "binary" in src:
+      return (json.dumps(src.binary, sort_keys=True), self.bundle.stamp)
+    return src.code
+
+  def get_payload(self, name):
+    """
+    Returns the parsed JSON payload of a source with the numeric arrays decoded into NumPy,
+    parsed once per source text. Bundle sources are views into the memory-mapped sidecar
+    """
+    src = self.json.config.srcs[name]
+    if "binary" in src:
+      content = src.binary
+      assert(self.bundle != None)
+    else:
+      content = src.code
+      if content == None:
+        return None
+    cached = self.payloads.get(name)
+    if cached != None and cached[0] is content:
+      return cached[1]
+    pending = self.pending_payloads.pop(name, None)
+    if pending != None and pending[0] is content:
+      payload = pending[1].result()
+    else:
+      payload = self.decode_payload(content, "binary" in src)
+    self.payloads[name] = (content, payload)
+    return payload
+
+  def decode_payload(self, content, binary):
+    """
+    Thread safe, content is the code or the binary skeleton of the source
+    """
+    if binary:
+      return replace_dict(self.bundle.decode(content))
+    return replace_dict(parse_payload(content))
+
+  def prefetch_payload(self, name):
+    """
+    Starts decoding a source on the asset threads, get_payload waits for the result
+    """
+    if self.asset_executor == None or name == None or name not in self.json.config.srcs:
+      return
+    src = self.json.config.srcs[name]
+    binary = "binary" in src
+    content = src.binary if binary else src.code
+    if content == None or name in self.payloads or name in self.pending_payloads:
+      return
+    self.pending_payloads[name] = (
+        content, self.asset_executor.submit(self.decode_payload, content, binary))
+
+  def prefetch_model(self, filename):
+    if self.asset_executor == None or filename in self.pending_models:
+      return
+    self.pending_models[filename] = self.asset_executor.submit(self.model_cache.load, filename)
+
+  def load_model(self, filename):
+    """
+    Returns the meshes of a model file(see ModelCache.load), prefetched or not
+    """
+    pending = self.pending_models.pop(filename, None)
+    if pending != None:
+      return pending.result()
+    return self.model_cache.load(filename)
+
+  def prefetch_assets(self):
+    """
+    Queues the decoding of every asset the graph references, so that it overlaps with
+    the GL setup and the assets decode in parallel with each other
+    """
+    for node in self.nodes:
+      if hasattr(node, 'prefetch'):
+        node.prefetch()
+
+  def cancel_prefetch(self):
+    for content, future in self.pending_payloads.values():
+      future.cancel()
+    for future in self.pending_models.values():
+      future.cancel()
+    self.pending_payloads = {}
+    self.pending_models = {}
+
+  def set_payload(self, name, payload):
+    """
+    Seeds the payload cache with an already decoded payload, e.g. shared by another process
+    """
+    src = self.json.config.srcs[name]
+    content = src.binary if "binary" in src else src.code
+    self.payloads[name] = (content, payload)
+    self.graph_version += 1
+
   def load_json(self, filename):
-    self.json = replace_dict(json.load(open(filename)))
+    self.load_graph(json.load(open(filename)), os.path.dirname(filename))
+
+  def create_node(self, json_node):
+    assert(json_node["type"] in NODE_TYPES and "unknown node type")
+    return NODE_TYPES[json_node["type"]](self, json_node)
+
+  def load_graph(self, json_dict, root="."):
+    """
+    Loads a graph dictionary, root is where the bundle sidecar is looked up
+    """
+    self.json = LazyAD(json_dict)
     self.release()
+    self.cancel_prefetch()
+    self.payloads = {}
+    self.bundle = None
+    if "config" in self.json and "bundle" in self.json.config:
+      self.bundle = Bundle(os.path.join(root, self.json.config.bundle.file))
     self.nodes = []
     self.id2node = {}
     self.links = []
     self.id2link = {}
     assert("nodes" in self.json)
     for json_node in self.json["nodes"]:
-      if json_node["type"] == "gfx/PassNode":
-        self.nodes.append(PassNode(self, json_node))
-      elif json_node["type"] == "gfx/BackBufferNode":
-        self.nodes.append(BackBufferNode(self, json_node))
-      elif json_node["type"] == "gfx/DrawCallNode":
-        self.nodes.append(DrawCallNode(self, json_node))
-      elif json_node["type"] == "gfx/PipelineNode":
-        self.nodes.append(PipelineNode(self, json_node))
-      elif json_node["type"] == "gfx/VertexBufferNode":
-        self.nodes.append(VertexBufferNode(self, json_node))
-      elif json_node["type"] == "gfx/ModelNode":
-        self.nodes.append(ModelNode(self, json_node))
-      elif json_node["type"] == "gfx/TextureBufferNode":
-        self.nodes.append(TextureBufferNode(self, json_node))
-      elif json_node["type"] == "gfx/FeedbackNode":
-        self.nodes.append(FeedbackNode(self, json_node))
-      elif json_node["type"] == "gfx/FrameCountNode":
-        self.nodes.append(FrameCountNode(self, json_node))
+      self.nodes.append(self.create_node(json_node))
+
+    for json_link in self.json["links"]:
+      self.links.append(Link(self, json_link))
+    self.reschedule()
+    self.prefetch_assets()
+    self.graph_version += 1
+
+  def reload_json(self, filename):
+    return self.reload_graph(json.load(open(filename)), os.path.dirname(filename))
+
+  def reload_graph(self, json_dict, root="."):
+    """
+    Applies a new version of the graph to the live one. Nodes are matched by id and type and
+    keep their GL resources and decoded sources, the next update() rebuilds only the nodes
+    whose signature changed(properties, source content, incoming links) and their consumers.
+    Returns the ids of the (added, removed) nodes
+    """
+    old_srcs = self.json.config.srcs if "config" in self.json else {}
+    old_keys = dict((name, self.get_src_key(name)) for name in old_srcs.keys())
+    old_bundle = self.bundle
+    self.json = LazyAD(json_dict)
+    self.bundle = None
+    if "config" in self.json and "bundle" in self.json.config:
+      self.bundle = Bundle(os.path.join(root, self.json.config.bundle.file))
+      if old_bundle != None and old_bundle.stamp == self.bundle.stamp:
+        self.bundle = old_bundle
+
+    # Sources with the same content keep their decoded payloads and the pending decodes
+    srcs = self.json.config.srcs if "config" in self.json else {}
+    for name, old_key in old_keys.items():
+      if name not in srcs or self.get_src_key(name) != old_key:
+        self.payloads.pop(name, None)
+        pending = self.pending_payloads.pop(name, None)
+        if pending != None:
+          pending[1].cancel()
+        continue
+      src = srcs[name]
+      content = src.binary if "binary" in src else src.code
+      if name in self.payloads:
+        self.payloads[name] = (content, self.payloads[name][1])
+      if name in self.pending_payloads:
+        self.pending_payloads[name] = (content, self.pending_payloads[name][1])
+
+    old_nodes = self.id2node
+    self.nodes = []
+    self.id2node = {}
+    self.links = []
+    self.id2link = {}
+    added = []
+    assert("nodes" in self.json)
+    for json_node in self.json["nodes"]:
+      node = old_nodes.get(json_node["id"])
+      if node != None and type(node) is NODE_TYPES.get(json_node["type"]):
+        del old_nodes[node.id]
+        node.reload(json_node)
+        self.id2node[node.id] = node
       else:
-        assert(False and "unknown node type")
+        node = self.create_node(json_node)
+        added.append(node.id)
+      self.nodes.append(node)
+    # Nodes that are gone(or changed type) give their resources back right away
+    for node in old_nodes.values():
+      if node.gl_signature != None and hasattr(node, 'gl_release'):
+        with self.profile(node, "release"):
+          node.gl_release()
+      node.gl_signature = None
 
     for json_link in self.json["links"]:
       self.links.append(Link(self, json_link))
+    self.sinks = set(node_id for node_id in self.sinks if node_id in self.id2node)
+    self.reschedule()
+    self.prefetch_assets()
+    self.graph_version += 1
+    return added, list(old_nodes.keys())
 
   def render_triangle(self):
     vsSource = """#version 300 es
@@ -741,16 +1229,13 @@ class GlobalState:
       }
       """
 
-    VERTEX_SHADER = shaders.compileShader(vsSource, gl.GL_VERTEX_SHADER)
+    program = self.program_cache.acquire(vsSource, fsSource)
 
-    FRAGMENT_SHADER = shaders.compileShader(fsSource, gl.GL_FRAGMENT_SHADER)
-
-    program = shaders.compileProgram(VERTEX_SHADER, FRAGMENT_SHADER)
-
-    gl.glUseProgram(program)
+    state = self.state
+    state.use_program(program)
 
     triangleArray = gl.glGenVertexArrays(1)
-    gl.glBindVertexArray(triangleArray)
+    state.bind_vertex_array(triangleArray)
 
     positions = np.float32([
         -0.5, -0.5, 0.0,
@@ -776,151 +1261,66 @@ class GlobalState:
     gl.glVertexAttribPointer(1, 3, gl.GL_FLOAT, False, 0, None)
     gl.glEnableVertexAttribArray(1)
 
-    gl.glDisable(gl.GL_CULL_FACE)
-    gl.glFrontFace(gl.GL_CW)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_SCISSOR_TEST)
-    gl.glDepthFunc(gl.GL_LEQUAL)
-    gl.glDisable(gl.GL_BLEND)
-    gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE)
+    state.disable(gl.GL_CULL_FACE)
+    state.front_face(gl.GL_CW)
+    state.disable(gl.GL_DEPTH_TEST)
+    state.disable(gl.GL_SCISSOR_TEST)
+    state.depth_func(gl.GL_LEQUAL)
+    state.disable(gl.GL_BLEND)
+    state.blend_func(gl.GL_ONE, gl.GL_ONE)
     gl.glDrawArrays(gl.GL_TRIANGLES, 0, 3)
 
     gl.glDeleteBuffers(1, positionBuffer)
     gl.glDeleteBuffers(1, colorBuffer)
-    gl.glDeleteVertexArrays(1, triangleArray)
-    gl.glDeleteProgram(program)
+    state.delete_vertex_array(triangleArray)
+    self.program_cache.release(program)
+
+  def set_offscreen(self, width, height):
+    """
+    Makes BackBufferNode render into an RGBA8 texture(self.offscreen) instead of the default
+    framebuffer, for contexts that don't have one(surfaceless EGL)
+    """
+    if self.offscreen != None:
+      self.rt_pool.release(self.offscreen)
+    self.width = width
+    self.height = height
+    self.offscreen = self.rt_pool.acquire("RGBA8", width, height)
+    self.graph_version += 1
+
+  def get_backbuffer(self):
+    """
+    Returns the framebuffer and the draw buffer BackBufferNode renders into
+    """
+    if self.offscreen == None:
+      return 0, gl.GL_BACK
+    return self.rt_pool.get_framebuffer([self.offscreen]), gl.GL_COLOR_ATTACHMENT0
 
   def render_texture(self, tex, format=None, flipy=False):
     """
     Renders a fullscreen quad with the given texture
     """
-    vsSource = """#version 300 es
-      precision highp float;
-        in vec2 position;
-        out vec2 uv;
-        void main() {
-            uv = 0.5 * (position + 1.0);
-            uv.y = 1.0 - uv.y;
-            gl_Position = vec4(position, 0, 1);
-        }
-      """
-    fsSource = """#version 300 es
-      precision highp float;
-      precision highp int;
-      precision highp usampler2D;
-      precision highp isampler2D;
-      in vec2 uv;
-      uniform sampler2D in_tex;
-      out vec4 fragColor;
-      void main() {
-          fragColor = vec4(vec3(texture(in_tex, uv).xyz), 1.0);
-      }
-      """
-    if flipy:
-      vsSource = vsSource.replace("uv.y = 1.0 - uv.y;", "uv.y = uv.y;")
-
-    if format:
-      if format == "RGBA32UI":
-        fsSource = fsSource.replace(
-            "uniform sampler2D", "uniform usampler2D")
-      elif format == "RGBA32F":
-        pass
-      elif format == "RGBA8UN":
-        pass
-      else:
-        raise "unknown format"
-
-    VERTEX_SHADER = shaders.compileShader(vsSource, gl.GL_VERTEX_SHADER)
-
-    FRAGMENT_SHADER = shaders.compileShader(fsSource, gl.GL_FRAGMENT_SHADER)
-
-    program = shaders.compileProgram(VERTEX_SHADER, FRAGMENT_SHADER)
-
-    gl.glUseProgram(program)
-
-    triangleArray = gl.glGenVertexArrays(1)
-    gl.glBindVertexArray(triangleArray)
-
-    data = np.float32([-4, -4, 4, -4, 0, 4])
-
-    positionBuffer = gl.glGenBuffers(1)
-    gl.glBindBuffer(gl.GL_ARRAY_BUFFER, positionBuffer)
-    gl.glBufferData(gl.GL_ARRAY_BUFFER, data, gl.GL_STATIC_DRAW)
-    gl.glVertexAttribPointer(0, 2, gl.GL_FLOAT, False, 0, None)
-    gl.glEnableVertexAttribArray(0)
-
-    gl.glActiveTexture(gl.GL_TEXTURE0 + 0)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, tex)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-    gl.glUniform1i(gl.glGetUniformLocation(program, "in_tex"), 0)
-
-    gl.glDisable(gl.GL_CULL_FACE)
-    gl.glFrontFace(gl.GL_CW)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_SCISSOR_TEST)
-    gl.glDepthFunc(gl.GL_LEQUAL)
-    gl.glDisable(gl.GL_BLEND)
-    gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE)
-    gl.glDrawArrays(gl.GL_TRIANGLES, 0, 3)
-
-    gl.glDeleteBuffers(1, positionBuffer)
-    gl.glDeleteVertexArrays(1, triangleArray)
-    gl.glDeleteProgram(program)
+    self.blitter.draw(tex, format, flipy)
 
   def create_texture(self, data, width, height, format="RGBA8UN"):
-    texture = gl.glGenTextures(1)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+    texture = create_texture()
     assert(format == "RGBA8UN")
     level = 0
-    internalFormat = gl.GL_RGBA
-    border = 0
+    internalFormat = gl.GL_RGBA8
     format = gl.GL_RGBA
     type = gl.GL_UNSIGNED_BYTE
-    gl.glTexImage2D(gl.GL_TEXTURE_2D, level, internalFormat,
-                    width, height, border,
-                    format, type, data)
+    gl.glTextureStorage2D(texture, 1, internalFormat, width, height)
+    gl.glTextureSubImage2D(texture, level, 0, 0, width, height,
+                           format, type, data)
     return texture
 
   def get_texture_data(self, tex, format, width, height):
-    targetTexture = gl.glGenTextures(1)
-    gl.glBindTexture(gl.GL_TEXTURE_2D, targetTexture)
-
-    gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA,
-                    width, height, 0,
-                    gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, None)
-
-    # set the filtering so we don't need mips
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-    gl.glTexParameteri(
-        gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-
-    # Create and bind the framebuffer
-    fb = gl.glGenFramebuffers(1)
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fb)
-    gl.glFramebufferTexture2D(
-        gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0, gl.GL_TEXTURE_2D, targetTexture, 0)
-
-    gl.glDisable(gl.GL_CULL_FACE)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_DEPTH_TEST)
-    gl.glDisable(gl.GL_SCISSOR_TEST)
-    gl.glDepthFunc(gl.GL_LEQUAL)
-    gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE)
-
-    gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fb)
-    glDrawBuffers([gl.GL_COLOR_ATTACHMENT0])
-    gl.glViewport(0, 0, width, height)
-    gl.glClearColor(0, 0, 1, 1)
+    self.blitter.bind_target(width, height)
+
+    state = self.state
+    state.draw_buffers([gl.GL_COLOR_ATTACHMENT0])
+    state.viewport(0, 0, width, height)
+    state.clear_color(0, 0, 1, 1)
+    state.depth_mask(True)
     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
 
     self.render_texture(tex, format)
@@ -928,44 +1328,316 @@ class GlobalState:
     img_buf = gl.glReadPixelsub(
         0, 0, width, height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE)
     img = np.frombuffer(img_buf, np.uint8).reshape(height, width, 4)[::-1]
-
-    gl.glDeleteFramebuffers(1, fb)
-    gl.glDeleteTextures(1, targetTexture)
     return img
 
-  def render(self):
+  def read_texture(self, tex, format, width, height, out=None):
     """
-    Evaluates the frame graph
+    Asynchronous readback of a texture in its native format, returns a Readback,
+    see ReadbackRing.read
     """
-    sorted = self.toposort()
+    return self.readback.read(tex, format, width, height, out)
+
+  def read_node(self, node_id, slot=0, out=None):
+    """
+    Asynchronous readback of a render target. Targets are shared between passes,
+    so the node has to be a sink(add_sink) to be read after the frame
+    """
+    node = self.id2node[node_id]
+    format, width, height = node.get_target_desc(slot)
+    return self.read_texture(node.get_texture(slot), format, width, height, out)
+
+  def capture(self, node_id, slot=0, count=None, out=None):
+    """
+    Renders count frames(forever if None) and yields the render target of the node for each
+    of them. Readbacks are pipelined through the ring so the frame that was just rendered
+    is never waited on. out is an optional list of preallocated arrays used round-robin,
+    an array is overwritten len(out) frames after it was yielded
+    """
+    was_sink = node_id in self.sinks
+    self.add_sink(node_id)
+    queue = deque()
+    try:
+      i = 0
+      while count == None or i < count:
+        self.render()
+        array = out[i % len(out)] if out != None else None
+        queue.append(self.read_node(node_id, slot, array))
+        if len(queue) >= len(self.readback.buffers):
+          yield queue.popleft().result()
+        i += 1
+      while len(queue) != 0:
+        yield queue.popleft().result()
+    finally:
+      if not was_sink:
+        self.remove_sink(node_id)
+
+  def update(self, sorted):
+    """
+    Retained mode: (re)creates GL resources only for the nodes whose signature changed
+    since the last frame. Versions are bumped so that the dependent nodes are rebuilt as well
+    """
+    changed = sorted is not self.planned_order
+    self.rebuilt = []
     for node in sorted:
+      signature = node.get_signature()
+      if signature == node.gl_signature:
+        continue
+      self.rebuilt.append(node.id)
+      if node.gl_signature != None:
+        if hasattr(node, 'gl_release'):
+          with self.profile(node, "release"):
+            node.gl_release()
+        node.invalidate()
       if hasattr(node, 'gl_init'):
-        node.gl_init()
+        with self.profile(node, "init"):
+          node.gl_init()
+      node.gl_signature = signature
+      node.gl_version += 1
+      changed = True
+    if changed:
+      self.plan_targets(sorted)
+      self.mesh_cache.collect()
+
+  def get_use_index(self, node_id, index):
+    """
+    Returns the index of the node that reads the inputs of the given node,
+    nodes without gl_render(draw calls) are executed by their consumers
+    """
+    node = self.id2node[node_id]
+    if hasattr(node, 'gl_render'):
+      return index[node_id]
+    uses = [self.get_use_index(id, index)
+            for id in self.scheduler.outputs[node_id] if id in index]
+    return max(uses) if len(uses) != 0 else len(index)
+
+  def plan_targets(self, sorted):
+    """
+    Assigns the render targets from their lifetimes in the frame so that targets that are
+    never alive at the same time share a texture. A target lives from its pass to the last
+    node reading it, targets of the sinks live until the end of the frame.
+    Passes clear their targets, so nothing is carried over between the sharing passes
+    """
+    index = dict((node.id, i) for i, node in enumerate(sorted))
+    self.cacheable = self.get_cacheable(sorted)
+    consumers = {}
+    for link in self.links:
+      consumers.setdefault((link.origin_node_id, link.origin_slot), []).append(
+          link.target_node_id)
+    sinks = set(self.scheduler.sinks)
+    nodes = [node for node in sorted if hasattr(node, 'get_targets')]
+    targets = []
+    for node in nodes:
+      first = index[node.id]
+      keep = node.id in sinks or (
+          len(sinks) == 0 and len(self.scheduler.outputs[node.id]) == 0)
+      if node.id in self.cacheable:
+        # The result is reused by the next frames, nothing else may write the textures
+        first = -1
+        keep = True
+      for slot, desc in enumerate(node.get_targets()):
+        last = first
+        if keep:
+          last = len(sorted)
+        for id in consumers.get((node.id, slot), []):
+          if id in index:
+            last = max(last, self.get_use_index(id, index))
+        targets.append((desc, first, last))
+    textures = self.rt_pool.plan(targets)
+    offset = 0
+    for node in nodes:
+      count = len(node.get_targets())
+      node.set_targets(textures[offset:offset + count])
+      offset += count
+    self.planned_order = sorted
+
+  def is_dynamic(self, node_id, memo):
+    """
+    True when the node or anything upstream changes every frame(frame counter, feedback)
+    """
+    if node_id not in memo:
+      memo[node_id] = True  # cycles go through FeedbackNodes, which are dynamic anyway
+      node = self.id2node[node_id]
+      memo[node_id] = node.is_dynamic or any(
+          self.is_dynamic(id, memo) for id in node.get_input_ids())
+    return memo[node_id]
+
+  def get_cacheable(self, sorted):
+    """
+    Returns the ids of the passes whose results can be reused across frames
+    """
+    memo = {}
+    return set(node.id for node in sorted
+               if hasattr(node, 'get_targets') and not self.is_dynamic(node.id, memo))
+
+  def get_render_signature(self, node):
+    """
+    Inputs of a pass for this frame: the versions of the node and its draw calls, and for
+    every input of the draw calls the value or the version and render count of its origin
+    """
+    draws = []
+    for i in range(len(node.inputs)):
+      draw = node.get_input_node_by_slot(i)
+      if draw == None:
+        continue
+      inputs = []
+      for j in range(len(draw.inputs)):
+        origin = draw.get_input_node_by_slot(j)
+        if origin == None:
+          continue
+        if hasattr(origin, 'get_value'):
+          link = self.id2link[draw.inputs[j].link]
+          inputs.append(origin.get_value(link.origin_slot))
+        else:
+          inputs.append((origin.id, origin.gl_version, origin.render_count))
+      draws.append((draw.id, draw.gl_version, tuple(inputs)))
+    return (node.gl_version, tuple(draws))
+
+  def get_pass_stats(self):
+    """
+    Passes executed and skipped(result reused) in the last frame
+    """
+    return dict(executed=self.passes_executed, skipped=self.passes_skipped)
+
+  def set_camera(self, view, proj):
+    self.camera = AD(view=np.asarray(view, np.float32).reshape(4, 4),
+                     proj=np.asarray(proj, np.float32).reshape(4, 4))
+
+  def get_time(self):
+    if self.time_step != None:
+      return self.frame_count * self.time_step
+    if self.start_time == None:
+      self.start_time = time.perf_counter()
+    return time.perf_counter() - self.start_time
+
+  def update_frame_block(self):
+    """
+    Fills the Frame block and binds it for every pipeline, once per frame
+    """
+    if self.frame_block == None:
+      self.frame_block = UniformBlock(FRAME_SIZE, FRAME_LAYOUT)
+    block = self.frame_block
+    block.set("_frame", self.frame_count)
+    block.set("_time", self.get_time())
+    block.set("_screen_size", (self.width, self.height))
+    block.set("_view", self.camera.view)
+    block.set("_proj", self.camera.proj)
+    # proj * view, with column-major storage the product is taken the other way around
+    block.set("_viewproj", self.camera.view @ self.camera.proj)
+    block.upload()
+    self.state.bind_buffer_base(gl.GL_UNIFORM_BUFFER, FRAME_BINDING, block.buffer)
+
+  def compile(self, sorted):
+    """
+    Records the command list render replays when replay is set(see renderpy.commands)
+    """
+    steps = []
+    for node in sorted:
+      if hasattr(node, 'compile_pass'):
+        steps.append(node.compile_pass(self.pass_caching and node.id in self.cacheable))
+      elif hasattr(node, 'gl_render'):
+        steps.append(NodeCommand(node))
+    self.commands = CommandList(self.graph_version, sorted, steps)
+
+  def invalidate_commands(self):
+    self.commands = None
+
+  def render(self):
+    """
+    Evaluates the frame graph. Passes that don't depend on anything dynamic are skipped
+    when their inputs didn't change since they last ran(see pass_caching).
+    With replay the recorded command list runs instead, as long as the graph doesn't change
+    (profiling always walks the nodes)
+    """
+    self.state.begin_frame()
+    if self.profiler != None:
+      self.profiler.begin_frame(self.frame_count)
+    sorted = self.toposort()
+    replay = self.replay and self.profiler == None
+    if not replay or self.commands == None or not self.commands.is_valid(self.graph_version,
+                                                                          sorted):
+      self.update(sorted)
+      if replay:
+        self.compile(sorted)
+    self.update_frame_block()
+    self.passes_executed = 0
+    self.passes_skipped = 0
+    if replay:
+      self.commands.replay(self)
+      self.frame_count += 1
+      return
     for node in sorted:
       if hasattr(node, 'gl_render'):
-        node.gl_render()
-    for node in reversed(sorted):
-      if hasattr(node, 'gl_release'):
-        node.gl_release()
+        if self.pass_caching and node.id in self.cacheable:
+          signature = self.get_render_signature(node)
+          if signature == node.gl_result:
+            self.passes_skipped += 1
+            continue
+          node.gl_result = signature
+        if hasattr(node, 'get_targets'):
+          self.passes_executed += 1
+        with self.profile(node, "render", gpu=True):
+          node.gl_render()
+        node.render_count += 1
+    if self.profiler != None:
+      self.profiler.end_frame()
     self.frame_count += 1
-    pass
 
   def release(self):
-    pass
+    """
+    Releases all the GL resources held by the nodes
+    """
+    for node in reversed(self.nodes):
+      if node.gl_signature == None:
+        continue
+      if hasattr(node, 'gl_release'):
+        with self.profile(node, "release"):
+          node.gl_release()
+      node.gl_signature = None
+    self.planned_order = None
+    self.commands = None
+
+  def gl_release(self):
+    """
+    Releases the nodes and the shared GL objects(blitter, program cache)
+    """
+    self.release()
+    self.disable_profiler()
+    self.mesh_cache.gl_release()
+    if self.frame_block != None:
+      self.frame_block.gl_release(self.state)
+      self.frame_block = None
+    self.rt_pool.gl_release()
+    self.offscreen = None
+    self.readback.gl_release()
+    self.planned_order = None
+    self.blitter.gl_release()
+    self.program_cache.clear()
+    self.state.gl_release()
 
 
 # import OpenGL.GLUT as glut
 
 
 if __name__ == '__main__':
+  # Interactive window, see renderpy.headless for rendering without a display server
+  import sys
   import OpenGL.GLU as glu
   import OpenGL.GLUT as glut
+  from .watch import GraphWatcher
+  from .frame_loop import FrameLoop
+  filename = sys.argv[1] if len(sys.argv) > 1 else "public/examples/multipass_test.json"
   global_state = GlobalState()
-  global_state.load_json("public/default_graph.json")
+  global_state.load_json(filename)
+  # Saving the graph again applies the changes to the running window
+  watcher = GraphWatcher(global_state, filename)
+  # Two frames in flight, the statistics go to stdout every few seconds
+  loop = FrameLoop(global_state, frames_in_flight=2, history=600)
+  last_report = [time.perf_counter()]
   def showScreen():
     global global_state
     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
     try:
+      watcher.poll()
       # tex = global_state.create_texture(np.uint8([
       #     255, 128, 0, 255,
       #     0, 128, 0, 255,
@@ -973,7 +1645,10 @@ if __name__ == '__main__':
       #     255, 128, 254, 255,
       # ]), 2, 2)
       # global_state.render_triangle()
-      global_state.render()
+      loop.step(present=glut.glutSwapBuffers)
+      if time.perf_counter() - last_report[0] > 5.0:
+        last_report[0] = time.perf_counter()
+        print(loop.format_stats())
       # print(gl.glGetError())
       # gl.glDrawBuffers([int(gl.GL_COLOR_ATTACHMENT0)])
       # gl.glClear(gl.GL_COLOR_BUFFER_BIT)
@@ -995,8 +1670,6 @@ if __name__ == '__main__':
       # #                origin='upper')
 
       # plt.show()
-
-      glut.glutSwapBuffers()
     except Exception as e:
       import traceback
       traceback.print_exc()
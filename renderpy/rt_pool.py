@@ -0,0 +1,139 @@
+import OpenGL.GL as gl
+
+from .state import create_texture, create_framebuffer
+
+# Render target formats used by PassNode: internal format and bytes per pixel
+TARGET_FORMATS = {
+    "RGBA8": (gl.GL_RGBA8, 4),
+    "RGBA32F": (gl.GL_RGBA32F, 16),
+    "D16": (gl.GL_DEPTH_COMPONENT16, 2),
+    "D32": (gl.GL_DEPTH_COMPONENT32F, 4),
+}
+
+
+def get_target_size(desc):
+  format, width, height = desc
+  return TARGET_FORMATS[format][1] * width * height
+
+
+class RenderTargetPool:
+  """
+  Owns the render target textures, keyed by (format, width, height), and the framebuffers
+  made of them.
+  plan() assigns physical textures to the targets of a frame from their lifetimes, targets
+  that are never alive at the same time share a texture. acquire()/release() hand out
+  textures outside of the plan(e.g. feedback copies) from the same free lists.
+  """
+
+  def __init__(self, state):
+    self.state = state
+    self.descs = {}
+    self.free = {}
+    self.planned = []
+    self.framebuffers = {}
+    self.allocations = 0
+    self.logical = 0
+
+  def acquire(self, format, width, height):
+    desc = (format, width, height)
+    free = self.free.get(desc)
+    if free:
+      return free.pop()
+    if format not in TARGET_FORMATS:
+      raise RuntimeError("unknown format %s" % format)
+    tex = create_texture()
+    gl.glTextureStorage2D(tex, 1, TARGET_FORMATS[format][0], width, height)
+    self.descs[tex] = desc
+    self.allocations += 1
+    return tex
+
+  def release(self, tex):
+    self.free.setdefault(self.descs[tex], []).append(tex)
+
+  def plan(self, targets):
+    """
+    targets is a list of (desc, first, last) where first and last are the indices of the
+    first and the last node using the target in the frame. Returns a texture per target.
+    Greedy interval assignment: a texture is reused once the last use of its previous
+    target is strictly before the first use of the next one
+    """
+    for tex in self.planned:
+      self.release(tex)
+    order = sorted(range(len(targets)), key=lambda i: targets[i][1])
+    slots = []
+    active = []
+    free = {}
+    assignment = [None] * len(targets)
+    for i in order:
+      desc, first, last = targets[i]
+      still_active = []
+      for slot, slot_last in active:
+        if slot_last < first:
+          free.setdefault(slots[slot], []).append(slot)
+        else:
+          still_active.append((slot, slot_last))
+      active = still_active
+      if free.get(desc):
+        slot = free[desc].pop()
+      else:
+        slot = len(slots)
+        slots.append(desc)
+      active.append((slot, last))
+      assignment[i] = slot
+    self.planned = [self.acquire(*desc) for desc in slots]
+    self.logical = len(targets)
+    self.trim()
+    return [self.planned[slot] for slot in assignment]
+
+  def clear_texture(self, tex):
+    format = self.descs[tex][0]
+    if format in ["D16", "D32"]:
+      gl.glClearTexImage(tex, 0, gl.GL_DEPTH_COMPONENT, gl.GL_FLOAT, None)
+    else:
+      gl.glClearTexImage(tex, 0, gl.GL_RGBA, gl.GL_FLOAT, None)
+
+  def get_framebuffer(self, colors, depth=None):
+    """
+    Returns the framebuffer with the given attachments, created once per attachment set
+    """
+    key = (tuple(colors), depth)
+    fb = self.framebuffers.get(key)
+    if fb != None:
+      return fb
+    fb = create_framebuffer()
+    for i, tex in enumerate(colors):
+      gl.glNamedFramebufferTexture(fb, gl.GL_COLOR_ATTACHMENT0 + i, tex, 0)
+    if depth != None:
+      gl.glNamedFramebufferTexture(fb, gl.GL_DEPTH_ATTACHMENT, depth, 0)
+    self.framebuffers[key] = fb
+    return fb
+
+  def delete_texture(self, tex):
+    for key in list(self.framebuffers.keys()):
+      if tex in key[0] or tex == key[1]:
+        self.state.delete_framebuffer(self.framebuffers.pop(key))
+    self.state.delete_texture(tex)
+    del self.descs[tex]
+
+  def trim(self):
+    """
+    Deletes the textures nobody holds
+    """
+    for free in self.free.values():
+      for tex in free:
+        self.delete_texture(tex)
+    self.free = {}
+
+  def get_stats(self):
+    return dict(targets=self.logical,
+                textures=len(self.descs),
+                bytes=sum(get_target_size(desc) for desc in self.descs.values()),
+                framebuffers=len(self.framebuffers),
+                allocations=self.allocations)
+
+  def gl_release(self):
+    for tex in list(self.descs.keys()):
+      self.delete_texture(tex)
+    self.free = {}
+    self.planned = []
+    self.logical = 0
@@ -0,0 +1,113 @@
+from collections import deque
+
+
+class CycleError(RuntimeError):
+  def __init__(self, nodes):
+    self.nodes = nodes
+    names = " -> ".join("%s(%s)" % (node.title, node.id) for node in nodes)
+    super().__init__("Cycle in the frame graph: " + names +
+                     ". Use a FeedbackNode to read the previous frame")
+
+
+class Scheduler:
+  """
+  Frame graph adjacency built once per graph.
+  Nodes are ordered with Kahn's algorithm in O(V+E), edges coming out of recursive nodes
+  (FeedbackNode) don't constrain the order since they carry the previous frame.
+  Only the nodes reachable from the sinks(BackBufferNode and the readback sinks) are scheduled,
+  without any sinks the whole graph is.
+  """
+
+  def __init__(self, nodes, id2link, sinks=()):
+    self.nodes = nodes
+    self.id2node = {}
+    self.inputs = {}
+    self.outputs = {}
+    for node in nodes:
+      self.id2node[node.id] = node
+      self.inputs[node.id] = []
+      self.outputs[node.id] = []
+    for node in nodes:
+      seen = set()
+      for o in node.inputs:
+        link_id = o.link
+        if not link_id:
+          continue
+        origin_id = id2link[link_id].origin_node_id
+        if origin_id in seen or origin_id not in self.id2node:
+          continue
+        seen.add(origin_id)
+        self.inputs[node.id].append(origin_id)
+        self.outputs[origin_id].append(node.id)
+    self.sinks = [id for id in sinks if id in self.id2node]
+    self.reachable = self.get_reachable()
+    self.order = self.sort()
+
+  def get_reachable(self):
+    """
+    Returns the set of node ids the sinks depend on
+    """
+    if len(self.sinks) == 0:
+      return set(self.id2node.keys())
+    reachable = set(self.sinks)
+    stack = list(self.sinks)
+    while len(stack) != 0:
+      id = stack.pop()
+      for input_id in self.inputs[id]:
+        if input_id not in reachable:
+          reachable.add(input_id)
+          stack.append(input_id)
+    return reachable
+
+  def is_scheduled(self, node):
+    return node.id in self.reachable and not node.is_recursive
+
+  def sort(self):
+    """
+    Returns the list of nodes in topological order with the recursive nodes at the end
+    """
+    indegree = {}
+    for node in self.nodes:
+      if not self.is_scheduled(node):
+        continue
+      cnt = 0
+      for input_id in self.inputs[node.id]:
+        if self.is_scheduled(self.id2node[input_id]):
+          cnt += 1
+      indegree[node.id] = cnt
+    queue = deque(node for node in self.nodes
+                  if node.id in indegree and indegree[node.id] == 0)
+    sorted = []
+    while len(queue) != 0:
+      node = queue.popleft()
+      sorted.append(node)
+      for output_id in self.outputs[node.id]:
+        if output_id not in indegree:
+          continue
+        indegree[output_id] -= 1
+        if indegree[output_id] == 0:
+          queue.append(self.id2node[output_id])
+    if len(sorted) != len(indegree):
+      raise CycleError(self.find_cycle(
+          set(id for id, cnt in indegree.items() if cnt > 0)))
+    for node in self.nodes:
+      if node.is_recursive and node.id in self.reachable:
+        sorted.append(node)
+    return sorted
+
+  def find_cycle(self, remaining):
+    """
+    Every node left over by Kahn's algorithm has an input among the left over nodes,
+    so walking the inputs from any of them must end up in a cycle
+    """
+    path = []
+    index = {}
+    id = next(iter(remaining))
+    while id not in index:
+      index[id] = len(path)
+      path.append(id)
+      id = next(input_id for input_id in self.inputs[id] if input_id in remaining)
+    cycle = path[index[id]:]
+    cycle.reverse()
+    cycle.append(cycle[0])
+    return [self.id2node[id] for id in cycle]
@@ -0,0 +1,234 @@
+import numpy as np
+import OpenGL
+import OpenGL.GL as gl
+
+# Shadow value for state that was never set or was touched behind our back
+UNKNOWN = object()
+
+
+def create_object(fn, *args):
+  """
+  Wrapper for the glCreate* family(DSA), the object exists right away without binding it
+  """
+  out = np.zeros(1, np.uint32)
+  fn(*(args + (1, out)))
+  return int(out[0])
+
+
+def create_texture():
+  return create_object(gl.glCreateTextures, gl.GL_TEXTURE_2D)
+
+
+def create_framebuffer():
+  return create_object(gl.glCreateFramebuffers)
+
+
+class GLState:
+  """
+  Shadow copy of the GL state the renderer touches. Every setter skips the GL call when
+  the value is already current, issued/skipped calls are counted per frame.
+  Objects must be deleted through the tracker so that recycled names are not mistaken for bound ones.
+  Call invalidate() after touching GL state directly.
+  """
+
+  def __init__(self):
+    self.samplers = {}
+    self.issued = 0
+    self.skipped = 0
+    self.frame_issued = 0
+    self.frame_skipped = 0
+    self.invalidate()
+
+  def invalidate(self):
+    self.program = UNKNOWN
+    self.vertex_array = UNKNOWN
+    self.draw_framebuffer = UNKNOWN
+    self.read_framebuffer = UNKNOWN
+    self.fb_draw_buffers = {}
+    self.viewport_rect = UNKNOWN
+    self.caps = {}
+    self.depth_func_value = UNKNOWN
+    self.depth_mask_value = UNKNOWN
+    self.blend_func_value = UNKNOWN
+    self.front_face_value = UNKNOWN
+    self.clear_color_value = UNKNOWN
+    self.clear_depth_value = UNKNOWN
+    self.textures = {}
+    self.unit_samplers = {}
+    self.buffers = {}
+    self.buffer_bases = {}
+
+  def begin_frame(self):
+    """
+    Starts counting for a new frame, the counts of the previous one stay in get_stats()
+    """
+    self.frame_issued = self.issued
+    self.frame_skipped = self.skipped
+    self.issued = 0
+    self.skipped = 0
+
+  def get_stats(self):
+    return dict(issued=self.frame_issued, skipped=self.frame_skipped)
+
+  def changed(self, old, new):
+    if old is not UNKNOWN and old == new:
+      self.skipped += 1
+      return False
+    self.issued += 1
+    return True
+
+  def use_program(self, program):
+    if self.changed(self.program, program):
+      gl.glUseProgram(program)
+      self.program = program
+
+  def bind_vertex_array(self, vao):
+    if self.changed(self.vertex_array, vao):
+      gl.glBindVertexArray(vao)
+      self.vertex_array = vao
+
+  def bind_framebuffer(self, fb):
+    if self.changed((self.draw_framebuffer, self.read_framebuffer), (fb, fb)):
+      gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, fb)
+      self.draw_framebuffer = fb
+      self.read_framebuffer = fb
+
+  def draw_buffers(self, buffers):
+    """
+    Draw buffers are framebuffer state, so they're remembered per framebuffer object
+    """
+    buffers = tuple(buffers)
+    fb = self.draw_framebuffer
+    if self.changed(self.fb_draw_buffers.get(fb, UNKNOWN), buffers):
+      try:
+        gl.glDrawBuffers(list(buffers))
+      except OpenGL.GL.GLError as err:
+        assert err.err == 1280
+      self.fb_draw_buffers[fb] = buffers
+
+  def viewport(self, x, y, width, height):
+    rect = (x, y, width, height)
+    if self.changed(self.viewport_rect, rect):
+      gl.glViewport(x, y, width, height)
+      self.viewport_rect = rect
+
+  def enable(self, cap, enable=True):
+    if self.changed(self.caps.get(cap, UNKNOWN), enable):
+      if enable:
+        gl.glEnable(cap)
+      else:
+        gl.glDisable(cap)
+      self.caps[cap] = enable
+
+  def disable(self, cap):
+    self.enable(cap, False)
+
+  def depth_func(self, func):
+    if self.changed(self.depth_func_value, func):
+      gl.glDepthFunc(func)
+      self.depth_func_value = func
+
+  def depth_mask(self, mask):
+    if self.changed(self.depth_mask_value, mask):
+      gl.glDepthMask(mask)
+      self.depth_mask_value = mask
+
+  def blend_func(self, src, dst):
+    if self.changed(self.blend_func_value, (src, dst)):
+      gl.glBlendFunc(src, dst)
+      self.blend_func_value = (src, dst)
+
+  def front_face(self, mode):
+    if self.changed(self.front_face_value, mode):
+      gl.glFrontFace(mode)
+      self.front_face_value = mode
+
+  def clear_color(self, r, g, b, a):
+    if self.changed(self.clear_color_value, (r, g, b, a)):
+      gl.glClearColor(r, g, b, a)
+      self.clear_color_value = (r, g, b, a)
+
+  def clear_depth(self, depth):
+    if self.changed(self.clear_depth_value, depth):
+      gl.glClearDepth(depth)
+      self.clear_depth_value = depth
+
+  def bind_buffer(self, target, buf):
+    """
+    Non-indexed buffer bindings that are context state(e.g. GL_DRAW_INDIRECT_BUFFER),
+    the element buffer belongs to the VAO
+    """
+    if self.changed(self.buffers.get(target, UNKNOWN), buf):
+      gl.glBindBuffer(target, buf)
+      self.buffers[target] = buf
+
+  def bind_buffer_base(self, target, index, buf):
+    """
+    Indexed bindings(uniform buffers), binding one also changes the generic binding of the target
+    """
+    if self.changed(self.buffer_bases.get((target, index), UNKNOWN), buf):
+      gl.glBindBufferBase(target, index, buf)
+      self.buffer_bases[(target, index)] = buf
+      self.buffers[target] = buf
+
+  def bind_texture(self, unit, tex):
+    if self.changed(self.textures.get(unit, UNKNOWN), tex):
+      gl.glBindTextureUnit(unit, tex)
+      self.textures[unit] = tex
+
+  def bind_sampler(self, unit, sampler):
+    if self.changed(self.unit_samplers.get(unit, UNKNOWN), sampler):
+      gl.glBindSampler(unit, sampler)
+      self.unit_samplers[unit] = sampler
+
+  def get_sampler(self, filter=gl.GL_NEAREST, wrap=gl.GL_CLAMP_TO_EDGE):
+    key = (filter, wrap)
+    sampler = self.samplers.get(key)
+    if sampler == None:
+      sampler = gl.glGenSamplers(1)
+      gl.glSamplerParameteri(sampler, gl.GL_TEXTURE_MIN_FILTER, filter)
+      gl.glSamplerParameteri(sampler, gl.GL_TEXTURE_MAG_FILTER, filter)
+      gl.glSamplerParameteri(sampler, gl.GL_TEXTURE_WRAP_S, wrap)
+      gl.glSamplerParameteri(sampler, gl.GL_TEXTURE_WRAP_T, wrap)
+      self.samplers[key] = sampler
+    return sampler
+
+  def delete_program(self, program):
+    gl.glDeleteProgram(program)
+    if self.program == program:
+      # A deleted program stays in use until the next glUseProgram
+      self.program = UNKNOWN
+
+  def delete_vertex_array(self, vao):
+    gl.glDeleteVertexArrays(1, vao)
+    if self.vertex_array == vao:
+      self.vertex_array = 0
+
+  def delete_framebuffer(self, fb):
+    gl.glDeleteFramebuffers(1, fb)
+    if self.draw_framebuffer == fb:
+      self.draw_framebuffer = 0
+    if self.read_framebuffer == fb:
+      self.read_framebuffer = 0
+    self.fb_draw_buffers.pop(fb, None)
+
+  def delete_buffer(self, buf):
+    gl.glDeleteBuffers(1, buf)
+    for target, bound in self.buffers.items():
+      if bound == buf:
+        self.buffers[target] = 0
+    for key, bound in self.buffer_bases.items():
+      if bound == buf:
+        self.buffer_bases[key] = 0
+
+  def delete_texture(self, tex):
+    gl.glDeleteTextures(1, tex)
+    for unit, bound in self.textures.items():
+      if bound == tex:
+        self.textures[unit] = 0
+
+  def gl_release(self):
+    for sampler in self.samplers.values():
+      gl.glDeleteSamplers(1, sampler)
+    self.samplers = {}
+    self.invalidate()
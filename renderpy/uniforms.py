@@ -0,0 +1,200 @@
+"""
+Uniform uploads: the default block through glUniform*, uniform blocks packed with NumPy into
+uniform buffers.
+
+Pipelines can declare the per-frame block, filled by GlobalState and bound once per frame
+
+  layout(std140) uniform Frame {
+    int _frame;
+    float _time;
+    vec2 _screen_size;
+    mat4 _view;
+    mat4 _proj;
+    mat4 _viewproj;
+  };
+
+and a per-draw block named Draw whose members are fed by the value inputs of the draw call,
+like the plain uniforms. Matrices are flat and column-major, as glUniformMatrix* without transpose.
+"""
+import numpy as np
+import OpenGL.GL as gl
+
+from .state import create_object
+
+FRAME_BLOCK = "Frame"
+DRAW_BLOCK = "Draw"
+FRAME_BINDING = 0
+DRAW_BINDING = 1
+
+# Reflected GL types to the type names used by the editor
+GL_TYPE_NAMES = {
+    gl.GL_FLOAT: "float",
+    gl.GL_FLOAT_VEC2: "vec2",
+    gl.GL_FLOAT_VEC3: "vec3",
+    gl.GL_FLOAT_VEC4: "vec4",
+    gl.GL_INT: "int",
+    gl.GL_INT_VEC2: "ivec2",
+    gl.GL_INT_VEC3: "ivec3",
+    gl.GL_INT_VEC4: "ivec4",
+    gl.GL_UNSIGNED_INT: "uint",
+    gl.GL_FLOAT_MAT3: "mat3",
+    gl.GL_FLOAT_MAT4: "mat4",
+    gl.GL_SAMPLER_2D: "texture",
+    gl.GL_INT_SAMPLER_2D: "texture",
+    gl.GL_UNSIGNED_INT_SAMPLER_2D: "texture",
+    gl.GL_SAMPLER_2D_SHADOW: "texture",
+}
+
+# Type name -> (dtype, components per column, columns)
+UNIFORM_TYPES = {
+    "float": (np.float32, 1, 1),
+    "vec2": (np.float32, 2, 1),
+    "vec3": (np.float32, 3, 1),
+    "vec4": (np.float32, 4, 1),
+    "int": (np.int32, 1, 1),
+    "ivec2": (np.int32, 2, 1),
+    "ivec3": (np.int32, 3, 1),
+    "ivec4": (np.int32, 4, 1),
+    "uint": (np.uint32, 1, 1),
+    "mat3": (np.float32, 3, 3),
+    "mat4": (np.float32, 4, 4),
+}
+
+UNIFORM_SETTERS = {
+    "float": gl.glUniform1fv,
+    "vec2": gl.glUniform2fv,
+    "vec3": gl.glUniform3fv,
+    "vec4": gl.glUniform4fv,
+    "int": gl.glUniform1iv,
+    "ivec2": gl.glUniform2iv,
+    "ivec3": gl.glUniform3iv,
+    "ivec4": gl.glUniform4iv,
+    "uint": gl.glUniform1uiv,
+    "mat3": lambda loc, count, data: gl.glUniformMatrix3fv(loc, count, False, data),
+    "mat4": lambda loc, count, data: gl.glUniformMatrix4fv(loc, count, False, data),
+}
+
+
+def to_array(value, type):
+  """
+  Flattens a value(scalar, sequence or array) into the element type of the uniform
+  """
+  if type not in UNIFORM_TYPES:
+    raise RuntimeError("unsupported uniform type %s" % type)
+  dtype, comps, columns = UNIFORM_TYPES[type]
+  data = np.asarray(value, dtype).reshape(-1)
+  if len(data) == 0 or len(data) % (comps * columns) != 0:
+    raise RuntimeError("%d values don't make a %s" % (len(data), type))
+  return data
+
+
+def set_uniform(loc, type, value):
+  """
+  Sets a default block uniform of the program in use, arrays are set from the first element
+  """
+  data = to_array(value, type)
+  dtype, comps, columns = UNIFORM_TYPES[type]
+  UNIFORM_SETTERS[type](loc, len(data) // (comps * columns), data)
+
+
+def get_std140_layout(members):
+  """
+  members is [(name, type name)], returns ({name: (type name, offset, array size, array stride,
+  matrix stride)}, size) for a block of non-array members with the std140 rules
+  """
+  layout = {}
+  offset = 0
+  for name, type in members:
+    dtype, comps, columns = UNIFORM_TYPES[type]
+    if columns > 1:
+      # Columns are vec4 aligned
+      align, size, matrix_stride = 16, 16 * columns, 16
+    else:
+      align, size, matrix_stride = {1: 4, 2: 8}.get(comps, 16), 4 * comps, 0
+    offset = (offset + align - 1) // align * align
+    layout[name] = (type, offset, 1, 0, matrix_stride)
+    offset += size
+  return layout, (offset + 15) // 16 * 16
+
+
+FRAME_LAYOUT, FRAME_SIZE = get_std140_layout([
+    ("_frame", "int"),
+    ("_time", "float"),
+    ("_screen_size", "vec2"),
+    ("_view", "mat4"),
+    ("_proj", "mat4"),
+    ("_viewproj", "mat4"),
+])
+
+
+def reflect_block(program, name):
+  """
+  Returns (block index, size, {member: (type name, offset, array size, array stride,
+  matrix stride)})
+  of an active uniform block, None when the program doesn't use it
+  """
+  index = gl.glGetUniformBlockIndex(program, name)
+  if index == gl.GL_INVALID_INDEX:
+    return None
+  size = np.zeros(1, np.int32)
+  gl.glGetActiveUniformBlockiv(program, index, gl.GL_UNIFORM_BLOCK_DATA_SIZE, size)
+  count = np.zeros(1, np.int32)
+  gl.glGetActiveUniformBlockiv(program, index, gl.GL_UNIFORM_BLOCK_ACTIVE_UNIFORMS, count)
+  indices = np.zeros(count[0], np.int32)
+  gl.glGetActiveUniformBlockiv(program, index, gl.GL_UNIFORM_BLOCK_ACTIVE_UNIFORM_INDICES,
+                               indices)
+  props = {}
+  for pname in [gl.GL_UNIFORM_OFFSET, gl.GL_UNIFORM_ARRAY_STRIDE, gl.GL_UNIFORM_MATRIX_STRIDE]:
+    values = np.zeros(len(indices), np.int32)
+    gl.glGetActiveUniformsiv(program, len(indices), indices.astype(np.uint32), pname, values)
+    props[pname] = values.tolist()
+  members = {}
+  for i, uniform_index in enumerate(indices.tolist()):
+    member, member_size, member_type = gl.glGetActiveUniform(program, uniform_index)
+    member = member.decode()
+    if member.endswith("[0]"):
+      member = member[:-3]
+    members[member] = (GL_TYPE_NAMES.get(int(member_type)), props[gl.GL_UNIFORM_OFFSET][i],
+                       int(member_size), props[gl.GL_UNIFORM_ARRAY_STRIDE][i],
+                       props[gl.GL_UNIFORM_MATRIX_STRIDE][i])
+  return index, int(size[0]), members
+
+
+class UniformBlock:
+  """
+  CPU copy of a uniform block and the buffer behind it. set() packs the values at the member
+  offsets(see reflect_block and get_std140_layout), upload() only sends the block when a
+  value changed
+  """
+
+  def __init__(self, size, members):
+    self.members = members
+    self.data = np.zeros(size, np.uint8)
+    self.buffer = create_object(gl.glCreateBuffers)
+    gl.glNamedBufferStorage(self.buffer, size, None, gl.GL_DYNAMIC_STORAGE_BIT)
+    self.dirty = True
+    self.uploads = 0
+
+  def set(self, name, value):
+    type, offset, size, array_stride, matrix_stride = self.members[name]
+    dtype, comps, columns = UNIFORM_TYPES[type]
+    data = to_array(value, type)
+    column_size = comps * 4
+    # Values past the declared array size are dropped, like glUniform* does
+    for i in range(min(size, len(data) // (comps * columns))):
+      for column in range(columns):
+        start = offset + i * array_stride + column * matrix_stride
+        first = (i * columns + column) * comps
+        chunk = data[first:first + comps].view(np.uint8)
+        if not np.array_equal(self.data[start:start + column_size], chunk):
+          self.data[start:start + column_size] = chunk
+          self.dirty = True
+
+  def upload(self):
+    if self.dirty:
+      gl.glNamedBufferSubData(self.buffer, 0, len(self.data), self.data)
+      self.dirty = False
+      self.uploads += 1
+
+  def gl_release(self, state):
+    state.delete_buffer(self.buffer)
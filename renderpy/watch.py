@@ -0,0 +1,65 @@
+"""
+Hot reload: polls a graph file(and its bundle sidecar) and applies the changes to a live
+GlobalState with reload_graph, so only the edited nodes and their consumers are rebuilt.
+
+  python -m renderpy.headless public/examples/multipass_test.json --watch -o out/frame_%04d.png
+"""
+import os
+import sys
+import json
+import time
+
+
+class GraphWatcher:
+  """
+  Call poll() once per frame, files are checked at most every `interval` seconds.
+  A file that doesn't parse(e.g. caught in the middle of a save) is retried on the next change
+  """
+
+  def __init__(self, global_state, filename, interval=0.25):
+    self.global_state = global_state
+    self.filename = filename
+    self.interval = interval
+    self.last_check = time.perf_counter()
+    self.stamp = self.get_stamp()
+    self.reloads = 0
+
+  def get_files(self):
+    files = [self.filename]
+    bundle = self.global_state.bundle
+    if bundle != None and bundle.stamp != None:
+      files.append(bundle.filename)
+    return files
+
+  def get_stamp(self):
+    stamp = []
+    for filename in self.get_files():
+      try:
+        stat = os.stat(filename)
+        stamp.append((stat.st_size, stat.st_mtime_ns))
+      except OSError:
+        stamp.append(None)
+    return tuple(stamp)
+
+  def poll(self):
+    """
+    Returns (added, removed) node ids when the graph was reloaded, None otherwise
+    """
+    now = time.perf_counter()
+    if now - self.last_check < self.interval:
+      return None
+    self.last_check = now
+    stamp = self.get_stamp()
+    if stamp == self.stamp:
+      return None
+    self.stamp = stamp
+    try:
+      json_dict = json.load(open(self.filename))
+    except (OSError, ValueError) as e:
+      print("[WARNING] Can't reload %s: %s" % (self.filename, e), file=sys.stderr)
+      return None
+    result = self.global_state.reload_graph(json_dict, os.path.dirname(self.filename))
+    # The sidecar may have been replaced as well
+    self.stamp = self.get_stamp()
+    self.reloads += 1
+    return result